@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+# CandidatePairs.py - choose which image pairs are worth matching.
+#
+# Every image has a bounding sphere (image.center, image.radius) around
+# the 3d locations of its features (see 4a-matching.py.)  Two images
+# can only share features if their spheres (grown by the image fuzz)
+# intersect, so rather than visiting all n*(n-1)/2 pairs we look up the
+# neighbors of each image in a kd-tree of the sphere centers.
+
+import numpy as np
+import scipy.spatial
+
+# true if the image has a bounding sphere
+def placed(image):
+    return len(image.center) == 3 and np.all(np.isfinite(image.center)) \
+        and np.isfinite(image.radius)
+
+# return the sorted list of (i, j) index pairs (i < j) of images whose
+# bounding spheres are within image_fuzz of each other.  Images without
+# a bounding sphere can't be pruned and are paired with everything.
+def spatial_pairs(image_list, image_fuzz=0.0):
+    placed_list = []
+    unplaced = []
+    for i, image in enumerate(image_list):
+        if placed(image):
+            placed_list.append(i)
+        else:
+            unplaced.append(i)
+
+    pairs = set()
+    if len(placed_list):
+        centers = np.array([ image_list[i].center for i in placed_list ],
+                           dtype=np.float64)
+        radii = np.array([ image_list[i].radius for i in placed_list ],
+                         dtype=np.float64)
+        max_radius = np.max(radii)
+        tree = scipy.spatial.cKDTree(centers)
+        for a in range(len(placed_list)):
+            # candidates within the largest possible reach, then the
+            # exact sphere test
+            reach = radii[a] + max_radius + image_fuzz
+            for b in tree.query_ball_point(centers[a], reach):
+                if b <= a:
+                    continue
+                dist = np.linalg.norm(centers[a] - centers[b])
+                if dist <= radii[a] + radii[b] + image_fuzz:
+                    pairs.add( (placed_list[a], placed_list[b]) )
+    for i in unplaced:
+        for j in range(len(image_list)):
+            if i != j:
+                pairs.add( (min(i, j), max(i, j)) )
+    return sorted(pairs)
+
+# pairs of images that are close in time: each image is paired with
+# the next 'window' images.  The project image list is sorted by name,
+# which is time order for frames extracted from a movie (see
+# movie/2-extract-and-geotag-frames.py) so this is roughly n*window
+# pairs instead of n*(n-1)/2.  With loop_closure, images further apart
+# in time are also paired when their bounding spheres overlap (the
+# flight path crosses back over the same ground.)
+def sequential_pairs(image_list, window=5, loop_closure=False,
+                     image_fuzz=0.0):
+    pairs = set()
+    for i in range(len(image_list)):
+        for j in range(i+1, min(i+1+window, len(image_list))):
+            pairs.add( (i, j) )
+    if loop_closure:
+        for (i, j) in spatial_pairs(image_list, image_fuzz):
+            # unplaced images would pair with everything, only trust
+            # real sphere overlaps here
+            if j - i > window and placed(image_list[i]) \
+               and placed(image_list[j]):
+                pairs.add( (i, j) )
+    return sorted(pairs)
+
+# all n*(n-1)/2 pairs
+def all_pairs(image_list):
+    pairs = []
+    for i in range(len(image_list)):
+        for j in range(i+1, len(image_list)):
+            pairs.append( (i, j) )
+    return pairs
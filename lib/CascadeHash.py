@@ -0,0 +1,75 @@
+#!/usr/bin/python
+
+# CascadeHash.py - approximate k nearest neighbor matching of float
+# descriptors (SIFT, SURF) by cascade hashing.
+#
+# Every descriptor is reduced to a short binary code (the signs of a
+# set of random projections of the mean centered descriptor.)  Codes
+# that are close in hamming distance come from descriptors that are
+# close in L2, so the cheap code comparison picks a handful of
+# candidate neighbors for each query and only those are compared
+# exactly (L2) to choose the final k.  'candidates' trades accuracy for
+# speed: more candidates finds more of the true nearest neighbors.
+#
+# The codes are kept as +1/-1 float vectors rather than packed bits:
+# the dot product of two such codes is bits - 2 * hamming distance, so
+# a whole block of code comparisons is a single (blas) matrix product,
+# which in numpy beats counting bits of xor'd words.
+
+import numpy as np
+
+class CascadeHash():
+    def __init__(self, bits=128, candidates=10, seed=0,
+                 block_bytes=4*1024*1024):
+        self.bits = bits
+        self.candidates = candidates
+        self.seed = seed
+        self.block_bytes = block_bytes
+        self.projection = None  # (dim, bits) random projection
+
+    # binary codes (as +1/-1 float32 vectors) of the descriptors
+    def codes(self, des, mean):
+        if self.projection is None or self.projection.shape[0] != des.shape[1]:
+            # the same projection every run (and in every worker)
+            rng = np.random.RandomState(self.seed)
+            self.projection = rng.randn(des.shape[1], self.bits).astype(np.float32)
+        signs = np.dot(des - mean, self.projection) > 0.0
+        return np.where(signs, 1.0, -1.0).astype(np.float32)
+
+    # the (approximate) k nearest train descriptors of every query
+    # descriptor.  Returns (index, distance) as (N, k) arrays sorted by
+    # L2 distance.  If train has fewer than k descriptors the missing
+    # neighbors have index -1 and an infinite distance.
+    def knn(self, query, train, k=2):
+        query = np.asarray(query, dtype=np.float32)
+        train = np.asarray(train, dtype=np.float32)
+        n = len(query)
+        nt = len(train)
+        index = np.full( (n, k), -1, dtype=int )
+        dist = np.full( (n, k), np.inf )
+        if n == 0 or nt == 0:
+            return index, dist
+        kk = min(k, nt)
+        mean = np.mean(train, axis=0)
+        qcodes = self.codes(query, mean)
+        tcodes = self.codes(train, mean)
+        c = max(kk, min(self.candidates, nt))
+        # queries per block so the code comparisons are ~block_bytes
+        bq = int(max(1, self.block_bytes / (4 * nt)))
+        for qs in range(0, n, bq):
+            qb = query[qs:qs+bq]
+            rows = np.arange(len(qb))[:,np.newaxis]
+            # coarse: candidates with the closest codes (the largest
+            # code dot products)
+            sim = np.dot(qcodes[qs:qs+bq], tcodes.T)
+            if c < nt:
+                cand = np.argpartition(-sim, c-1, axis=1)[:,:c]
+            else:
+                cand = np.tile(np.arange(nt), (len(qb), 1))
+            # fine: exact L2 distance to the candidates
+            diff = train[cand] - qb[:,np.newaxis,:]
+            d = np.sqrt(np.sum(diff * diff, axis=2))
+            order = np.argsort(d, axis=1, kind='mergesort')[:,:kk]
+            index[qs:qs+bq,:kk] = cand[rows, order]
+            dist[qs:qs+bq,:kk] = d[rows, order]
+        return index, dist
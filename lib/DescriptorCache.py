@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+# DescriptorCache.py - keep a bounded (in bytes) set of image
+# descriptor lists resident in memory.
+#
+# Pairwise matching touches every image many times.  Rather than load
+# the descriptors of every image up front (which can easily exceed the
+# available memory for big image sets) the cache loads descriptors on
+# first use and evicts the least recently used images once the byte
+# budget is exceeded.  order_pairs() arranges the pair traversal in
+# blocks sized to the budget so most lookups are hits.
+
+import collections
+import numpy as np
+import os.path
+
+class DescriptorCache():
+    def __init__(self, budget_bytes=4*1024*1024*1024):
+        self.budget = budget_bytes
+        self.lru = collections.OrderedDict() # name -> (image, nbytes)
+        self.bytes = 0
+        self.min_resident = 2   # never evict the current pair of images
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def set_budget(self, budget_bytes):
+        self.budget = budget_bytes
+        self.evict()
+
+    # return the descriptors for the image (and make sure they are
+    # loaded in image.des_list)
+    def get(self, image):
+        if image.name in self.lru:
+            self.hits += 1
+            entry = self.lru.pop(image.name)
+            self.lru[image.name] = entry
+            return image.des_list
+        self.misses += 1
+        image.des_list = []
+        image.load_descriptors()
+        nbytes = np.asarray(image.des_list).nbytes
+        self.lru[image.name] = (image, nbytes)
+        self.bytes += nbytes
+        self.evict()
+        return image.des_list
+
+    def evict(self):
+        while self.bytes > self.budget and len(self.lru) > self.min_resident:
+            name, (image, nbytes) = self.lru.popitem(last=False)
+            image.des_list = []
+            self.bytes -= nbytes
+            self.evictions += 1
+
+    def clear(self):
+        for name in self.lru:
+            image, nbytes = self.lru[name]
+            image.des_list = []
+        self.lru = collections.OrderedDict()
+        self.bytes = 0
+
+    # estimate the size of the descriptors of an image without loading
+    # them
+    def estimate_bytes(self, image):
+        if image.archive and image.archive.has(image.name, 'desc'):
+            record = image.archive.records[ (image.name, 'desc') ]
+            return image.archive.record_bytes(record)
+        filename = image.des_file + ".npy"
+        if os.path.exists(filename):
+            return os.path.getsize(filename)
+        return 0
+
+    # Sort a list of (i, j) image index pairs so that consecutive pairs
+    # reuse the same images.  The images are split into blocks (by
+    # index) with two blocks fitting inside the budget, and all the
+    # pairs between one pair of blocks are visited before moving on.
+    def order_pairs(self, pairs, image_list):
+        if not len(image_list):
+            return list(pairs)
+        total = 0
+        for image in image_list:
+            total += self.estimate_bytes(image)
+        avg = float(total) / len(image_list)
+        if avg > 0.0:
+            block = max(1, int(self.budget / (2.0 * avg)))
+        else:
+            block = len(image_list)
+        return sorted(pairs, key=lambda p: (min(p) / block, max(p) / block,
+                                            p[0], p[1]))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        if lookups > 0:
+            hit_rate = float(self.hits) / lookups
+        else:
+            hit_rate = 0.0
+        return { 'budget-bytes': self.budget,
+                 'resident-bytes': self.bytes,
+                 'resident-images': len(self.lru),
+                 'hits': self.hits,
+                 'misses': self.misses,
+                 'evictions': self.evictions,
+                 'hit-rate': hit_rate }
+
+    def report(self):
+        s = self.stats()
+        print "Descriptor cache: %d hits, %d misses, %d evictions (%.1f%% hit rate)" \
+            % (s['hits'], s['misses'], s['evictions'], s['hit-rate'] * 100.0)
+        print "  resident: %d images, %.1f / %.1f Mb" \
+            % (s['resident-images'], s['resident-bytes'] / 1048576.0,
+               s['budget-bytes'] / 1048576.0)
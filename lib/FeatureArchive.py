@@ -0,0 +1,231 @@
+#!/usr/bin/python
+
+# FeatureArchive.py - a single project level store for the keypoints
+# and descriptors of every image.
+#
+# Instead of 2 small files per image (.feat.npy, .desc.npy) the project
+# keeps one keypoint blob, one descriptor blob, and an index file.  The
+# index is a text file with one json record per line:
+#
+#   { "name": image name, "kind": "kp" or "desc", "file": blob name,
+#     "generation": blob generation, "offset": byte offset,
+#     "count": rows, "cols": columns, "dtype": numpy dtype descr }
+#
+# The blobs and index are only ever appended to.  Array data is written
+# (and flushed to disk) before its index record, so a run that is
+# interrupted can at worst leave some unreferenced bytes at the end of
+# a blob or a partial last index line, both of which are ignored on
+# load.  When an image is saved again, the newer record supersedes the
+# older one.  compact() rewrites the live records into a fresh pair of
+# blobs to reclaim the space.
+
+import json
+import mmap
+import numpy as np
+import os
+
+import Keypoints
+
+class FeatureArchive():
+    def __init__(self, project_dir):
+        self.project_dir = project_dir
+        self.index_file = project_dir + "/features.idx"
+        self.generation = 0
+        self.records = {}       # (name, kind) -> latest index record
+        self.maps = {}          # blob name -> read only mmap of the blob
+        self.index_repaired = False
+        self.load()
+
+    def blob_name(self, kind, generation=None):
+        if generation == None:
+            generation = self.generation
+        return "features-%d.%s" % (generation, kind)
+
+    def load(self):
+        self.records = {}
+        self.generation = 0
+        if not os.path.exists(self.index_file):
+            return
+        blob_sizes = {}
+        f = open(self.index_file, 'r')
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # partially written (interrupted) record
+                continue
+            blob = self.project_dir + "/" + record['file']
+            if not blob in blob_sizes:
+                if os.path.exists(blob):
+                    blob_sizes[blob] = os.path.getsize(blob)
+                else:
+                    blob_sizes[blob] = 0
+            if record['offset'] + self.record_bytes(record) > blob_sizes[blob]:
+                # index record without the matching array data
+                continue
+            self.records[ (record['name'], record['kind']) ] = record
+            self.generation = max(self.generation, record['generation'])
+        f.close()
+
+    def record_bytes(self, record):
+        dtype = self.record_dtype(record)
+        return record['count'] * record['cols'] * dtype.itemsize
+
+    def record_dtype(self, record):
+        descr = record['dtype']
+        if isinstance(descr, list):
+            # structured dtype (json turns the field tuples into lists)
+            descr = [ tuple(field) for field in descr ]
+        return np.dtype(descr)
+
+    def has(self, name, kind):
+        return (name, kind) in self.records
+
+    def names(self, kind):
+        result = []
+        for (name, k) in self.records:
+            if k == kind:
+                result.append(name)
+        return result
+
+    # append an array (keypoint array or 2d descriptor array) for the
+    # named image
+    def append(self, name, kind, array):
+        array = np.ascontiguousarray(array)
+        if array.ndim == 2:
+            count, cols = array.shape
+        else:
+            count = len(array)
+            cols = 1
+        blob = self.blob_name(kind)
+        f = open(self.project_dir + "/" + blob, 'ab')
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        f.write(array.tostring())
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        record = { 'name': name,
+                   'kind': kind,
+                   'file': blob,
+                   'generation': self.generation,
+                   'offset': offset,
+                   'count': count,
+                   'cols': cols,
+                   'dtype': array.dtype.descr if array.dtype.names else array.dtype.str }
+        self.write_record(record)
+        self.records[ (name, kind) ] = record
+        # the blob grew, map it again when it is next read (views handed
+        # out earlier keep the old map alive as long as they need it)
+        if blob in self.maps:
+            del self.maps[blob]
+
+    # an interrupted run can leave a partial last index line with no
+    # newline, make sure the next record starts on a line of its own
+    # (otherwise it would be glued onto the partial line and lost too)
+    def repair_index(self):
+        if os.path.exists(self.index_file) \
+           and os.path.getsize(self.index_file) > 0:
+            f = open(self.index_file, 'rb+')
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != '\n':
+                f.seek(0, os.SEEK_END)
+                f.write('\n')
+                f.flush()
+                os.fsync(f.fileno())
+            f.close()
+        self.index_repaired = True
+
+    def write_record(self, record, f=None):
+        close = False
+        if f == None:
+            if not self.index_repaired:
+                self.repair_index()
+            f = open(self.index_file, 'a')
+            close = True
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+        if close:
+            f.close()
+
+    # each blob is mapped once and shared by every array read from it
+    # (one open file per blob rather than one per image and kind)
+    def blob_map(self, blob):
+        if not blob in self.maps:
+            f = open(self.project_dir + "/" + blob, 'rb')
+            self.maps[blob] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            f.close()
+        return self.maps[blob]
+
+    # return a read only view of the named array in the memory mapped
+    # blob (no data is copied until it is touched.)
+    def get(self, name, kind):
+        record = self.records[ (name, kind) ]
+        dtype = self.record_dtype(record)
+        if kind == 'kp':
+            shape = (record['count'],)
+        else:
+            shape = (record['count'], record['cols'])
+        if record['count'] == 0:
+            return np.zeros(shape, dtype=dtype)
+        data = np.frombuffer(self.blob_map(record['file']), dtype=dtype,
+                             count=record['count'] * record['cols'],
+                             offset=record['offset'])
+        return data.reshape(shape)
+
+    def append_keypoints(self, name, kp_array):
+        self.append(name, 'kp', np.asarray(kp_array, dtype=Keypoints.kp_dtype))
+
+    def append_descriptors(self, name, des_array):
+        if des_array is None or np.ndim(des_array) != 2:
+            # no features found (opencv returns None)
+            des_array = np.zeros( (0, 0), dtype=np.float32 )
+        self.append(name, 'desc', des_array)
+
+    def load_keypoints(self, name):
+        return self.get(name, 'kp')
+
+    def load_descriptors(self, name):
+        return self.get(name, 'desc')
+
+    # rewrite only the live records into a new generation of blobs,
+    # swap in the new index, then remove the old blobs.
+    def compact(self):
+        old_blobs = set()
+        for key in self.records:
+            old_blobs.add(self.records[key]['file'])
+        new_generation = self.generation + 1
+        new_records = {}
+        tmp_index = self.index_file + ".tmp"
+        fi = open(tmp_index, 'w')
+        blobs = {}
+        for key in sorted(self.records):
+            name, kind = key
+            record = dict(self.records[key])
+            array = np.ascontiguousarray(self.get(name, kind))
+            blob = self.blob_name(kind, new_generation)
+            if not blob in blobs:
+                blobs[blob] = open(self.project_dir + "/" + blob, 'wb')
+            record['file'] = blob
+            record['generation'] = new_generation
+            record['offset'] = blobs[blob].tell()
+            blobs[blob].write(array.tostring())
+            new_records[key] = record
+        for blob in blobs:
+            blobs[blob].flush()
+            os.fsync(blobs[blob].fileno())
+            blobs[blob].close()
+        for key in sorted(new_records):
+            self.write_record(new_records[key], fi)
+        fi.close()
+        # atomic swap to the new index
+        os.rename(tmp_index, self.index_file)
+        self.records = new_records
+        self.generation = new_generation
+        self.maps = {}
+        for blob in old_blobs:
+            try:
+                os.remove(self.project_dir + "/" + blob)
+            except OSError:
+                print "Notice: unable to remove old blob =", blob
@@ -0,0 +1,163 @@
+#!/usr/bin/python
+
+# FeatureIndex.py - one trained FLANN index (kd-forest or LSH tables)
+# per image, shared by every pair the image takes part in.
+#
+# Matching an image against each of its neighbors with
+# FlannBasedMatcher.knnMatch() rebuilds the search structure from
+# scratch for every pair and direction.  Instead we build one index
+# over all the descriptors of an image, query it from every
+# neighboring image, and save it next to the image features
+# (image.index_file) so later matching runs can just load it.  A small
+# json sidecar records the descriptor checksum and index parameters so
+# a stale index is never used.
+#
+# Resident indices (and the descriptor copies flann references) are
+# kept within a byte budget, which the caller carves out of the
+# descriptor cache budget so the two together stay within --cache-mb.
+#
+# Note: flann's kd-trees and LSH tables are randomized (and opencv
+# doesn't expose the seed), so the matches found through an index can
+# differ slightly between a fresh build and a reused index, and with
+# the number of matching processes.  That's why the index is opt-in.
+
+import collections
+import cv2
+import json
+import numpy as np
+import os
+import time
+import zlib
+
+class FeatureIndex():
+    def __init__(self, flann_params, norm=cv2.NORM_L2,
+                 budget_bytes=1024*1024*1024):
+        self.flann_params = flann_params
+        self.norm = norm
+        self.budget = budget_bytes
+        self.lru = collections.OrderedDict() # name -> (index, descriptors, nbytes)
+        self.bytes = 0
+        self.build_time = 0.0
+        self.load_time = 0.0
+        self.query_time = 0.0
+        self.builds = 0
+        self.loads = 0
+        self.queries = 0
+
+    # descriptors in the layout flann wants for this index type
+    def prepare(self, des_list):
+        if self.norm == cv2.NORM_L2:
+            return np.ascontiguousarray(des_list, dtype=np.float32)
+        else:
+            return np.ascontiguousarray(des_list, dtype=np.uint8)
+
+    def set_budget(self, budget_bytes):
+        self.budget = budget_bytes
+        self.evict()
+
+    # estimated memory of an index: the descriptor copy it references
+    # plus the search structure (kd-tree nodes per tree, or hash table
+    # entries per table)
+    def estimate_bytes(self, des):
+        if self.norm == cv2.NORM_L2:
+            per_row = 64 * self.flann_params.get('trees', 4)
+        else:
+            per_row = 16 * self.flann_params.get('table_number', 12)
+        return des.nbytes + len(des) * per_row
+
+    # drop the least recently used indices until within budget (the
+    # most recent one always stays, it is in use)
+    def evict(self):
+        while self.bytes > self.budget and len(self.lru) > 1:
+            name, entry = self.lru.popitem(last=False)
+            self.bytes -= entry[2]
+
+    def signature(self, des):
+        return { 'count': des.shape[0],
+                 'cols': des.shape[1],
+                 'crc32': zlib.crc32(des.tostring()) & 0xffffffff,
+                 'params': self.flann_params }
+
+    # return the index for the image (from memory, disk, or freshly
+    # built and saved)
+    def get(self, image):
+        if image.name in self.lru:
+            entry = self.lru.pop(image.name)
+            self.lru[image.name] = entry
+            return entry[0]
+        des = self.prepare(image.des_list)
+        sig = self.signature(des)
+        index = self.load(image, des, sig)
+        if index == None:
+            t0 = time.time()
+            index = cv2.flann_Index(des, self.flann_params)
+            self.build_time += time.time() - t0
+            self.builds += 1
+            self.save(image, index, sig)
+        # flann references (doesn't copy) the descriptor data, so keep
+        # the array alive alongside the index
+        nbytes = self.estimate_bytes(des)
+        self.lru[image.name] = (index, des, nbytes)
+        self.bytes += nbytes
+        self.evict()
+        return index
+
+    def load(self, image, des, sig):
+        sig_file = image.index_file + ".json"
+        if not os.path.exists(image.index_file) or not os.path.exists(sig_file):
+            return None
+        try:
+            f = open(sig_file, 'r')
+            saved_sig = json.load(f)
+            f.close()
+        except:
+            return None
+        if saved_sig != json.loads(json.dumps(sig)):
+            # descriptors or parameters changed since the index was saved
+            return None
+        t0 = time.time()
+        index = cv2.flann_Index()
+        if not index.load(des, image.index_file):
+            return None
+        self.load_time += time.time() - t0
+        self.loads += 1
+        return index
+
+    def save(self, image, index, sig):
+        try:
+            # write then rename so concurrent matching processes never
+            # see a partial file
+            tmp = image.index_file + ".%d.tmp" % os.getpid()
+            index.save(tmp)
+            os.rename(tmp, image.index_file)
+            tmp_sig = image.index_file + ".json.%d.tmp" % os.getpid()
+            f = open(tmp_sig, 'w')
+            json.dump(sig, f, sort_keys=True)
+            f.close()
+            os.rename(tmp_sig, image.index_file + ".json")
+        except:
+            print image.index_file + ": unable to save feature index"
+
+    # k nearest neighbors of the query descriptors among all the
+    # descriptors of the image.  Returns (indices, distances) as (N,k)
+    # arrays with distances in the same units as cv2 matchers report
+    # (euclidean for float descriptors, hamming for binary.)
+    def knn(self, image, query_des, k=2):
+        if len(image.des_list) < k or len(query_des) == 0:
+            # nothing to match
+            return np.zeros( (0, k), dtype=int ), np.zeros( (0, k) )
+        index = self.get(image)
+        t0 = time.time()
+        idx, dist = index.knnSearch(self.prepare(query_des), k, params={})
+        self.query_time += time.time() - t0
+        self.queries += 1
+        dist = np.asarray(dist, dtype=np.float64)
+        if self.norm == cv2.NORM_L2:
+            # flann reports squared euclidean distances
+            dist = np.sqrt(dist)
+        return np.asarray(idx, dtype=int).reshape(-1, k), dist.reshape(-1, k)
+
+    def report(self):
+        print "Feature index: %d built (%.1f sec), %d loaded (%.1f sec)" \
+            % (self.builds, self.build_time, self.loads, self.load_time)
+        print "  %d queries (%.1f sec)" % (self.queries, self.query_time)
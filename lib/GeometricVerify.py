@@ -0,0 +1,86 @@
+#!/usr/bin/python
+
+# GeometricVerify.py - one robust model fit per image pair.
+#
+# The matches between two images should all agree with a single
+# homography (flat scene), fundamental matrix, or essential matrix
+# (known calibration.)  verify() fits the model once with a sampling
+# estimator (RANSAC, or MAGSAC when this opencv has it) that stops as
+# soon as the requested confidence is reached, and returns the inlier
+# mask as a numpy bool array along with the model and inlier ratio.
+#
+# Matcher.verifyPair() runs this on the reciprocal matches of a pair
+# and applies the same mask to both directions, which replaces the
+# old filter until nothing changes loop.
+
+import cv2
+import numpy as np
+
+# available robust estimators: name -> (homography, fundamental/essential)
+methods = { 'ransac': (cv2.RANSAC, cv2.FM_RANSAC),
+            'lmeds': (cv2.LMEDS, cv2.FM_LMEDS) }
+if hasattr(cv2, 'USAC_MAGSAC'):
+    methods['magsac'] = (cv2.USAC_MAGSAC, cv2.USAC_MAGSAC)
+
+# findHomography() takes maxIters and confidence (and findEssentialMat()
+# exists) starting with opencv 3.x, 2.4 only takes the method and the
+# reprojection threshold
+opencv3 = hasattr(cv2, 'findEssentialMat')
+
+# pixel tolerance for an image of the given width
+def tolerance(width):
+    return max(1.0, float(width) / 100.0)
+
+# p1, p2: (N, 2) float32 arrays of corresponding image points.
+# Returns (model, inlier mask, inlier ratio).  The model is None (and
+# the mask all False) if the fit fails.
+def verify(p1, p2, filter="homography", tol=1.0, K=None, method='ransac',
+           confidence=0.999, max_iters=2000):
+    n = len(p1)
+    if filter == "none":
+        return None, np.ones(n, dtype=bool), 1.0
+    if method not in methods:
+        print "Unknown verify method:", method, "(using ransac)"
+        method = 'ransac'
+    (h_method, f_method) = methods[method]
+    p1 = np.float32(p1).reshape(-1, 2)
+    p2 = np.float32(p2).reshape(-1, 2)
+    M = None
+    status = None
+    try:
+        if filter == "homography":
+            if n >= 4 and opencv3:
+                M, status = cv2.findHomography(p1, p2, h_method, tol,
+                                               maxIters=max_iters,
+                                               confidence=confidence)
+            elif n >= 4:
+                M, status = cv2.findHomography(p1, p2, h_method, tol)
+        elif filter == "fundamental":
+            if n >= 8:
+                M, status = cv2.findFundamentalMat(p1, p2, f_method, tol,
+                                                   confidence)
+        elif filter == "essential":
+            if not opencv3:
+                print "Essential matrix filter needs opencv 3.x"
+            elif n >= 5:
+                if f_method == cv2.FM_RANSAC:
+                    e_method = cv2.RANSAC
+                elif f_method == cv2.FM_LMEDS:
+                    e_method = cv2.LMEDS
+                else:
+                    e_method = f_method
+                M, status = cv2.findEssentialMat(p1, p2, K, e_method,
+                                                 confidence, tol)
+        else:
+            print "Unknown filter:", filter
+    except cv2.error as e:
+        print "Geometric verification failed:", str(e).strip()
+        M, status = None, None
+    if M is None or status is None:
+        return None, np.zeros(n, dtype=bool), 0.0
+    mask = np.ravel(status).astype(bool)
+    if n:
+        ratio = float(np.count_nonzero(mask)) / n
+    else:
+        ratio = 0.0
+    return M, mask, ratio
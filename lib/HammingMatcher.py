@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+# HammingMatcher.py - brute force k nearest neighbor matching of binary
+# descriptors (ORB, Star/BRIEF) by hamming distance, in numpy.
+#
+# Descriptors are packed into uint64 words so one xor compares 64 bits
+# at a time, and the bits are counted with a 16 bit popcount lookup
+# table.  Queries are compared against the train descriptors in blocks
+# sized so the xor/popcount temporaries stay in cache, keeping a
+# running best k per query, so memory doesn't grow with the size of
+# the image pair.  The results are exact (every query is compared with
+# every train descriptor) and ties go to the lower train index.
+
+import numpy as np
+
+# number of set bits in every 16 bit value
+popcount16 = np.array([ bin(i).count('1') for i in range(1 << 16) ],
+                      dtype=np.uint8)
+
+# (N, bytes) uint8 descriptors -> (N, words) uint64 (zero padded to a
+# multiple of 8 bytes)
+def pack(des):
+    des = np.ascontiguousarray(des, dtype=np.uint8)
+    if des.size == 0:
+        return np.zeros( (0, 1), dtype=np.uint64 )
+    des = des.reshape(len(des), -1)
+    pad = (-des.shape[1]) % 8
+    if pad:
+        des = np.hstack( (des, np.zeros( (len(des), pad), dtype=np.uint8 )) )
+        des = np.ascontiguousarray(des)
+    return des.view(np.uint64)
+
+# (len(a), len(b)) hamming distances between two packed blocks
+def distances(a, b):
+    x = a[:,np.newaxis,:] ^ b[np.newaxis,:,:]
+    return popcount16[x.view(np.uint16)].sum(axis=2, dtype=np.int32)
+
+class HammingMatcher():
+    # a query block times a train block of xor'd descriptors is about
+    # block_bytes of temporaries
+    def __init__(self, block_bytes=4*1024*1024):
+        self.block_bytes = block_bytes
+
+    # the k nearest train descriptors of every query descriptor.
+    # Returns (index, distance) as (N, k) int arrays, sorted by
+    # distance.  If train has fewer than k descriptors the missing
+    # neighbors have index -1 and a distance larger than any real one.
+    def knn(self, query, train, k=2):
+        q = pack(query)
+        t = pack(train)
+        n = len(q)
+        nt = len(t)
+        index = np.full( (n, k), -1, dtype=int )
+        dist = np.full( (n, k), np.iinfo(np.int32).max, dtype=np.int32 )
+        if n == 0 or nt == 0:
+            return index, dist
+        # distance and train index combined in one sort key (distance *
+        # nt + index) so partial sorts break ties by the lower index
+        missing = np.iinfo(np.int64).max
+        best = np.full( (n, k), missing, dtype=np.int64 )
+        # square-ish blocks of about block_bytes of xor results
+        words = q.shape[1]
+        cells = max(1, self.block_bytes / (8 * words))
+        bt = int(max(k, min(nt, np.sqrt(cells))))
+        bq = int(max(1, min(n, cells / bt)))
+        for qs in range(0, n, bq):
+            qb = q[qs:qs+bq]
+            rows = np.arange(len(qb))[:,np.newaxis]
+            for ts in range(0, nt, bt):
+                d = distances(qb, t[ts:ts+bt])
+                key = d.astype(np.int64) * nt + np.arange(ts, ts+d.shape[1])
+                if key.shape[1] > k:
+                    part = np.argpartition(key, k-1, axis=1)[:,:k]
+                    key = key[rows, part]
+                # merge this block's best with the best so far
+                cand = np.hstack( (best[qs:qs+bq], key) )
+                cand.sort(axis=1)
+                best[qs:qs+bq] = cand[:,:k]
+        found = best != missing
+        index[found] = best[found] % nt
+        dist[found] = best[found] / nt
+        return index, dist
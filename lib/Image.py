@@ -4,6 +4,7 @@
 
 import cPickle as pickle
 import cv2
+import hashlib
 import json
 import math
 from matplotlib import pyplot as plt
@@ -12,28 +13,140 @@ import numpy as np
 import os.path
 import sys
 
+import JpegProbe
+import Keypoints
+import SpatialIndex
 import transformations
 
 
 d2r = math.pi / 180.0           # a helpful constant
     
+# opencv can decode jpegs directly at 1/2, 1/4, or 1/8 resolution
+# (scaling in the dct domain) which is much faster and uses much less
+# memory than a full decode followed by a resize.
+reduced_gray_flags = {}
+reduced_color_flags = {}
+for k in [ 2, 4, 8 ]:
+    if hasattr(cv2, 'IMREAD_REDUCED_GRAYSCALE_%d' % k):
+        reduced_gray_flags[k] = getattr(cv2, 'IMREAD_REDUCED_GRAYSCALE_%d' % k)
+        reduced_color_flags[k] = getattr(cv2, 'IMREAD_REDUCED_COLOR_%d' % k)
+
+# load an image scaled by the given factor (i.e. 0.25), using a reduced
+# resolution decode when the scale allows it, otherwise a full decode
+# and resize.
+def imread_scaled(filename, scale=1.0, gray=False):
+    k = int(round(1.0 / scale))
+    if k in reduced_gray_flags and abs(k * scale - 1.0) < 0.000001:
+        if gray:
+            return cv2.imread(filename, reduced_gray_flags[k])
+        else:
+            return cv2.imread(filename, reduced_color_flags[k])
+    img = cv2.imread(filename)
+    if gray:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if scale != 1.0:
+        img = cv2.resize(img, (0,0), fx=scale, fy=scale,
+                         interpolation=cv2.INTER_AREA)
+    return img
+
+# Feature detection helpers.  These live at module level (rather than
+# as Image methods) so a detector can be built once and reused across
+# many images, including from worker processes.
+
+def make_detector(dparams):
+    detector = None
+    if dparams['detector'] == 'SIFT':
+        max_features = int(dparams['sift-max-features'])
+        detector = cv2.SIFT(nfeatures=max_features)
+    elif dparams['detector'] == 'SURF':
+        threshold = float(dparams['surf-hessian-threshold'])
+        nOctaves = int(dparams['surf-noctaves'])
+        detector = cv2.SURF(hessianThreshold=threshold, nOctaves=nOctaves)
+    elif dparams['detector'] == 'ORB':
+        max_features = int(dparams['orb-max-features'])
+        grid_size = int(dparams['grid-detect'])
+        cells = grid_size * grid_size
+        max_cell_features = int(max_features / cells)
+        detector = cv2.ORB_create(max_cell_features)
+    elif dparams['detector'] == 'Star':
+        maxSize = int(dparams['star-max-size'])
+        responseThreshold = int(dparams['star-response-threshold'])
+        lineThresholdProjected = int(dparams['star-line-threshold-projected'])
+        lineThresholdBinarized = int(dparams['star-line-threshold-binarized'])
+        suppressNonmaxSize = int(dparams['star-suppress-nonmax-size'])
+        detector = cv2.StarDetector(maxSize, responseThreshold,
+                                    lineThresholdProjected,
+                                    lineThresholdBinarized,
+                                    suppressNonmaxSize)
+    return detector
+
+def orb_grid_detect(detector, image, grid_size):
+    steps = grid_size
+    kp_list = []
+    h, w = image.shape
+    dx = 1.0 / float(steps)
+    dy = 1.0 / float(steps)
+    x = 0.0
+    for i in xrange(steps):
+        y = 0.0
+        for j in xrange(steps):
+            #print "create mask (%dx%d) %d %d" % (w, h, i, j)
+            #print "  roi = %.2f,%.2f %.2f,%2f" % (y*h,(y+dy)*h-1, x*w,(x+dx)*w-1)
+            mask = np.zeros((h,w,1), np.uint8)
+            mask[y*h:(y+dy)*h-1,x*w:(x+dx)*w-1] = 255
+            kps = detector.detect(image, mask)
+            kp_list.extend( kps )
+            y += dy
+        x += dx
+    return kp_list
+
+# detect features and compute their descriptors on the given grayscale
+# image (loaded at the 'detect-scale' of the detector parameters.)
+# Returns (keypoint array in full image coordinates, descriptors).
+def detect(detector, dparams, gray):
+    grid_size = int(dparams['grid-detect'])
+    if dparams['detector'] == 'ORB' and grid_size > 1:
+        kp_list = orb_grid_detect(detector, gray, grid_size)
+    else:
+        kp_list = detector.detect(gray)
+
+    # compute the descriptors for the found features (Note: Star
+    # is a special case that uses the brief extractor
+    #
+    # compute() could potential add/remove keypoints so we want to
+    # save the returned keypoint list, not our original detected
+    # keypoint list
+    if dparams['detector'] == 'Star':
+        extractor = cv2.DescriptorExtractor_create('ORB')
+    else:
+        extractor = detector
+    kp_list, des_list = extractor.compute(gray, kp_list)
+    kp_array = Keypoints.from_cv2(kp_list)
+    scale = float(dparams.get('detect-scale', 1.0))
+    if scale != 1.0:
+        kp_array = Keypoints.rescale(kp_array, 1.0 / scale)
+    return kp_array, des_list
+
 class Image():
-    def __init__(self, image_dir=None, image_file=None):
+    def __init__(self, image_dir=None, image_file=None, metadb=None):
         self.name = None
         #self.img = None
         #self.img_rgb = None
         self.height = 0
         self.width = 0
-        self.kp_list = []       # opencv keypoint list
+        self.kp_list = Keypoints.KeypointList() # array backed keypoints
         self.kp_usage = []
         self.des_list = []      # opencv descriptor list
         self.match_list = []
+        self.archive = None     # project feature archive (if any)
+        self.metadb = metadb    # project meta data database (if any)
 
         self.uv_list = []       # the 'undistorted' uv coordinates of all kp's
         
         self.aircraft_pose = None
         self.camera_pose = None
         self.camera_pose_sba = None
+        self.pose_version = 0   # bumped whenever a pose changes
 
         # cam2body/body2cam are transforms to map between the standard
         # lens coordinate system (at zero roll/pitch/yaw and the
@@ -68,19 +181,29 @@ class Image():
         self.placed = False
 
         self.coord_list = []
+        self.kdtree = None      # SpatialIndex of coord_list (see spatial_index())
+        self.kdtree_key = None
         self.corner_list = []
         self.grid_list = []
 
         self.center = []
         self.radius = 0.0
+
+        # what the current features were detected from: image content
+        # hash (plus the file size/mtime it was computed for) and the
+        # detector parameter fingerprint
+        self.detect_signature = {}
         
         if image_file:
             self.name = image_file
             root, ext = os.path.splitext(image_file)
             file_root = image_dir + "/" + root
             self.image_file = image_dir + "/" + image_file
-            self.features_file = file_root + ".feat"
+            self.features_file = file_root + ".feat" # original format
+            self.kp_file = file_root + ".feat.npy"
             self.des_file = file_root + ".desc"
+            self.index_file = file_root + ".flann"
+            self.kdtree_file = file_root + ".kdtree"
             self.match_file = file_root + ".match"
             self.info_file = file_root + ".info"
             # only load meta data when instance is created, other
@@ -89,15 +212,28 @@ class Image():
             self.load_meta()
             
     def load_meta(self):
-        if not os.path.exists(self.info_file):
-            # no info file, create a new file
-            self.save_meta()
-            return
-        
+        image_dict = None
+        if self.metadb:
+            image_dict = self.metadb.get(self.name)
+        if image_dict == None:
+            if not os.path.exists(self.info_file):
+                # no meta data yet, create a new record
+                self.save_meta()
+                return
+            try:
+                f = open(self.info_file, 'r')
+                image_dict = json.load(f)
+                f.close()
+            except:
+                print self.info_file + ":\n" + "  load error: " \
+                    + str(sys.exc_info()[1])
+                return
+            if self.metadb:
+                # first use of the project meta data database, import
+                # the original .info file
+                self.metadb.put(self.name, image_dict)
+
         try:
-            f = open(self.info_file, 'r')
-            image_dict = json.load(f)
-            f.close()
             self.num_matches = image_dict['num-matches']
             if 'aircraft-pose' in image_dict:
                 self.aircraft_pose = image_dict['aircraft-pose']
@@ -132,8 +268,10 @@ class Image():
                 self.center = np.array(image_dict['bounding-center'])
             if 'bounding-radius' in image_dict:
                 self.radius = image_dict['bounding-radius']
+            if 'detect-signature' in image_dict:
+                self.detect_signature = image_dict['detect-signature']
         except:
-            print self.info_file + ":\n" + "  load error: " \
+            print self.name + ":\n" + "  meta data error: " \
                 + str(sys.exc_info()[1])
 
     def load_rgb(self, force_resize=False):
@@ -147,11 +285,30 @@ class Image():
             print self.image_file + ":\n" + "  load error: " \
                 + str(sys.exc_info()[1])
 
-    def load_source_rgb(self, source_dir):
+    # determine the image dimensions from the jpeg headers (no pixel
+    # decode), falling back to a full load for anything else
+    def probe_size(self):
+        result = JpegProbe.probe(self.image_file)
+        if result == None:
+            self.load_rgb(force_resize=True)
+            return
+        width, height, orientation = result
+        if orientation >= 5 and hasattr(cv2, 'IMREAD_IGNORE_ORIENTATION'):
+            # transposed exif orientations; newer opencv versions
+            # rotate these in imread() so match what load_rgb() sees
+            width, height = height, width
+        self.width = width
+        self.height = height
+        self.fulld = 3
+
+    def load_source_rgb(self, source_dir, scale=1.0):
         #print "Loading " + self.image_file
         source_name = source_dir + "/" + self.name
         try:
-            source_image = cv2.imread(source_name)
+            if scale == 1.0:
+                source_image = cv2.imread(source_name)
+            else:
+                source_image = imread_scaled(source_name, scale)
             return source_image
 
         except:
@@ -159,13 +316,18 @@ class Image():
                 + str(sys.exc_info()[1])
             return None
 
-    def load_gray(self):
+    # scale < 1.0 loads a reduced resolution version of the image
+    # (see imread_scaled())
+    def load_gray(self, scale=1.0):
         #print "Loading " + self.image_file
         try:
-            rgb = cv2.imread(self.image_file)
-            if self.height == 0 or self.width == 0:
-                self.height, self.width, self.fulld = img_rgb.shape
-            gray = cv2.cvtColor(rgb, cv2.COLOR_BGR2GRAY)
+            if scale == 1.0:
+                rgb = cv2.imread(self.image_file)
+                if self.height == 0 or self.width == 0:
+                    self.height, self.width, self.fulld = rgb.shape
+                gray = cv2.cvtColor(rgb, cv2.COLOR_BGR2GRAY)
+            else:
+                gray = imread_scaled(self.image_file, scale, gray=True)
 
             #cv2.imshow('rgb', rgb)
             #cv2.imshow('grayscale', gray)
@@ -189,42 +351,35 @@ class Image():
                 + str(sys.exc_info()[1])
 
     def load_features(self):
-        if len(self.kp_list) == 0 and os.path.exists(self.features_file):
-            #print "Loading " + self.features_file
-            try:
-                feature_list = pickle.load( open( self.features_file, "rb" ) )
-                for point in feature_list:
-                    kp = cv2.KeyPoint(x=point[0][0], y=point[0][1],
-                                      _size=point[1], _angle=point[2],
-                                      _response=point[3], _octave=point[4],
-                                      _class_id=point[5])
-                    self.kp_list.append(kp)
-            except:
-                # unpickle failed, try old style json
+        if len(self.kp_list) == 0:
+            if self.archive and self.archive.has(self.name, 'kp'):
+                kp_array = self.archive.load_keypoints(self.name)
+            elif os.path.exists(self.kp_file):
+                #print "Loading " + self.kp_file
+                try:
+                    kp_array = Keypoints.load(self.kp_file)
+                except:
+                    print self.kp_file + ":\n" + "  load error: " \
+                        + str(sys.exc_info()[0]) + ": " + str(sys.exc_info()[1])
+                    return
+            elif os.path.exists(self.features_file):
+                # original pickle (or older json) format
                 try:
-                    f = open(self.features_file, 'r')
-                    feature_dict = json.load(f)
-                    f.close()
+                    kp_array = Keypoints.load_legacy(self.features_file)
                 except:
                     print self.features_file + ":\n" + "  load error: " \
                         + str(sys.exc_info()[0]) + ": " + str(sys.exc_info()[1])
                     return
-
-                feature_list = feature_dict['features']
-                for i, kp_dict in enumerate(feature_list):
-                    angle = kp_dict['angle']
-                    class_id = kp_dict['class-id']
-                    octave = kp_dict['octave']
-                    pt = kp_dict['pt']
-                    response = kp_dict['response']
-                    size = kp_dict['size']
-                    self.kp_list.append( cv2.KeyPoint(pt[0], pt[1], size,
-                                                      angle, response, octave,
-                                                      class_id) )
+            else:
+                return
+            self.kp_list = Keypoints.KeypointList(kp_array)
 
     def load_descriptors(self):
         filename = self.des_file + ".npy"
-        if len(self.des_list) == 0 and os.path.exists(filename):
+        if len(self.des_list) == 0 and self.archive \
+           and self.archive.has(self.name, 'desc'):
+            self.des_list = self.archive.load_descriptors(self.name)
+        elif len(self.des_list) == 0 and os.path.exists(filename):
             #print "Loading " + filename
             try:
                 self.des_list = np.load(filename)
@@ -255,28 +410,77 @@ class Image():
                 return
 
     def save_features(self):
-        # convert from native opencv kp class to a python list
-        feature_list = []
-        for kp in self.kp_list:
-            point = (kp.pt, kp.size, kp.angle, kp.response, kp.octave,
-                     kp.class_id)
-            feature_list.append(point)
+        kp_array = Keypoints.as_array(self.kp_list)
         try:
-            pickle.dump(feature_list, open(self.features_file, "wb"))
+            if self.archive:
+                self.archive.append_keypoints(self.name, kp_array)
+            else:
+                Keypoints.save(self.kp_file, kp_array)
         except IOError as e:
             print "save_features(): I/O error({0}): {1}".format(e.errno, e.strerror)
             return
         except:
             raise
 
+    # convert an original format feature file to the binary keypoint
+    # format (if it hasn't been done already)
+    def upgrade_features(self, remove_legacy=False):
+        if os.path.exists(self.kp_file) or not os.path.exists(self.features_file):
+            return 0
+        return Keypoints.upgrade_file(self.features_file, self.kp_file,
+                                      remove_legacy)
+
     def save_descriptors(self):
         # write descriptors as 'ppm image' format
         try:
-            result = np.save(self.des_file, self.des_list)
+            if self.archive:
+                self.archive.append_descriptors(self.name, self.des_list)
+            else:
+                result = np.save(self.des_file, self.des_list)
         except:
             print self.des_file + ": error saving file: " \
                 + str(sys.exc_info()[1])
 
+    # true if keypoints and descriptors have been saved for this image
+    def has_features(self):
+        if self.archive and self.archive.has(self.name, 'kp') \
+           and self.archive.has(self.name, 'desc'):
+            return True
+        return (os.path.exists(self.kp_file) \
+                or os.path.exists(self.features_file)) \
+                and os.path.exists(self.des_file + ".npy")
+
+    # sha1 of the image file contents.  The hash recorded with the
+    # current features is reused if the file size and modification time
+    # haven't changed since it was computed.
+    def content_hash(self):
+        try:
+            st = os.stat(self.image_file)
+        except OSError:
+            return None
+        sig = self.detect_signature
+        if sig.get('image-size') == st.st_size \
+           and sig.get('image-mtime') == st.st_mtime \
+           and 'image-hash' in sig:
+            return sig['image-hash']
+        h = hashlib.sha1()
+        f = open(self.image_file, 'rb')
+        while True:
+            block = f.read(1024*1024)
+            if not block:
+                break
+            h.update(block)
+        f.close()
+        return h.hexdigest()
+
+    # record what the current features were detected from
+    def set_detect_signature(self, image_hash, params_hash):
+        st = os.stat(self.image_file)
+        self.detect_signature = { 'image-hash': image_hash,
+                                  'image-size': st.st_size,
+                                  'image-mtime': st.st_mtime,
+                                  'params-hash': params_hash }
+
     def save_matches(self):
         try:
             pickle.dump(self.match_list, open(self.match_file, "wb"))
@@ -312,6 +516,11 @@ class Image():
         image_dict['stddev'] = self.stddev
         image_dict['bounding-center'] = list(self.center)
         image_dict['bounding-radius'] = self.radius
+        image_dict['detect-signature'] = self.detect_signature
+
+        if self.metadb:
+            self.metadb.put(self.name, image_dict)
+            return
 
         try:
             f = open(self.info_file, 'w')
@@ -324,97 +533,69 @@ class Image():
         except:
             raise
 
+    # return the kd-tree of coord_list (also kept in self.kdtree.)  It
+    # is only rebuilt when the pose or the coordinates change.  With
+    # cache=True the tree is also saved to (and loaded from)
+    # kdtree_file.
+    def spatial_index(self, cache=False, balanced_tree=False,
+                      compact_nodes=False):
+        if not len(self.coord_list):
+            self.kdtree = None
+            self.kdtree_key = None
+            return None
+        key = (self.pose_version, SpatialIndex.points_crc(self.coord_list))
+        if self.kdtree != None and self.kdtree_key == key:
+            return self.kdtree
+        index = None
+        if cache:
+            index = SpatialIndex.load(self.kdtree_file, self.coord_list)
+        if index == None:
+            index = SpatialIndex.SpatialIndex(self.coord_list, balanced_tree,
+                                              compact_nodes)
+            if cache:
+                index.save(self.kdtree_file)
+        self.kdtree = index
+        self.kdtree_key = key
+        return index
+
     def make_detector(self, dparams):
-        detector = None
-        if dparams['detector'] == 'SIFT':
-            max_features = int(dparams['sift-max-features'])
-            detector = cv2.SIFT(nfeatures=max_features)
-        elif dparams['detector'] == 'SURF':
-            threshold = float(dparams['surf-hessian-threshold'])
-            nOctaves = int(dparams['surf-noctaves'])
-            detector = cv2.SURF(hessianThreshold=threshold, nOctaves=nOctaves)
-        elif dparams['detector'] == 'ORB':
-            max_features = int(dparams['orb-max-features'])
-            grid_size = int(dparams['grid-detect'])
-            cells = grid_size * grid_size
-            max_cell_features = int(max_features / cells)
-            detector = cv2.ORB_create(max_cell_features)
-        elif dparams['detector'] == 'Star':
-            maxSize = int(dparams['star-max-size'])
-            responseThreshold = int(dparams['star-response-threshold'])
-            lineThresholdProjected = int(dparams['star-line-threshold-projected'])
-            lineThresholdBinarized = int(dparams['star-line-threshold-binarized'])
-            suppressNonmaxSize = int(dparams['star-suppress-nonmax-size'])
-            detector = cv2.StarDetector(maxSize, responseThreshold,
-                                        lineThresholdProjected,
-                                        lineThresholdBinarized,
-                                        suppressNonmaxSize)
-        return detector
+        return make_detector(dparams)
 
     def orb_grid_detect(self, detector, image, grid_size):
-        steps = grid_size
-        kp_list = []
-        h, w = image.shape
-        dx = 1.0 / float(steps)
-        dy = 1.0 / float(steps)
-        x = 0.0
-        for i in xrange(steps):
-            y = 0.0
-            for j in xrange(steps):
-                #print "create mask (%dx%d) %d %d" % (w, h, i, j)
-                #print "  roi = %.2f,%.2f %.2f,%2f" % (y*h,(y+dy)*h-1, x*w,(x+dx)*w-1)
-                mask = np.zeros((h,w,1), np.uint8)
-                mask[y*h:(y+dy)*h-1,x*w:(x+dx)*w-1] = 255
-                kps = detector.detect(image, mask)
-                kp_list.extend( kps )
-                y += dy
-            x += dx
-        return kp_list
-
-    def detect_features(self, dparams, gray):
-        detector = self.make_detector(dparams)
-        grid_size = int(dparams['grid-detect'])
-        if dparams['detector'] == 'ORB' and grid_size > 1:
-            kp_list = self.orb_grid_detect(detector, gray, grid_size)
-        else:
-            kp_list = detector.detect(gray)
-
-        # compute the descriptors for the found features (Note: Star
-        # is a special case that uses the brief extractor
-        #
-        # compute() could potential add/remove keypoints so we want to
-        # save the returned keypoint list, not our original detected
-        # keypoint list
-        if dparams['detector'] == 'Star':
-            extractor = cv2.DescriptorExtractor_create('ORB')
-        else:
-            extractor = detector
-        self.kp_list, self.des_list = extractor.compute(gray, kp_list)
+        return orb_grid_detect(detector, image, grid_size)
+
+    # detector may be passed in to avoid rebuilding it for every image
+    def detect_features(self, dparams, gray, detector=None):
+        if detector == None:
+            detector = make_detector(dparams)
+        kp_array, des_list = detect(detector, dparams, gray)
+        self.set_features(kp_array, des_list)
+
+    # install newly detected keypoints and descriptors
+    def set_features(self, kp_array, des_list):
+        self.kp_list = Keypoints.KeypointList(kp_array)
+        self.des_list = des_list
         
         # wipe matches because we've touched the keypoints
         self.match_list = []
 
     # Displays the image in a window and waits for a keystroke and
     # then destroys the window.  Returns the value of the keystroke.
-    def show_features(self, flags=0):
+    # An already decoded image (i.e. the gray image the features were
+    # just detected on) may be passed in to avoid loading it again.
+    def show_features(self, flags=0, gray=None):
         # flags=0: draw only keypoints location
         # flags=4: draw rich keypoints
-        rgb = self.load_rgb()
+        if gray is None:
+            rgb = self.load_rgb()
+        else:
+            rgb = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
         scale = 1000.0 / float(self.height)
-        kp_list = []
-        for kp in self.kp_list:
-            angle = kp.angle
-            class_id = kp.class_id
-            octave = kp.octave
-            pt = kp.pt
-            response = kp.response
-            size = kp.size
-            x = pt[0] * scale
-            y = pt[1] * scale
-            kp_list.append( cv2.KeyPoint(x, y, size, angle, response,
-                                         octave, class_id) )
-
-        scaled_image = cv2.resize(rgb, (0,0), fx=scale, fy=scale)
+        kp_list = self.kp_list.to_cv2(scale=scale)
+
+        # the passed in image may be reduced resolution
+        img_scale = 1000.0 / float(rgb.shape[0])
+        scaled_image = cv2.resize(rgb, (0,0), fx=img_scale, fy=img_scale)
         res = cv2.drawKeypoints(scaled_image, kp_list, None,
                                 color=(0,255,0), flags=flags)
         cv2.imshow(self.name, res)
@@ -455,6 +636,7 @@ class Image():
                                                      ypr[2] * d2r,
                                                      'rzyx')
         self.aircraft_pose = { 'lla': lla, 'ypr': ypr, 'quat': quat.tolist() }
+        self.pose_version += 1
 
     def get_aircraft_pose(self):
         p = self.aircraft_pose
@@ -472,6 +654,7 @@ class Image():
                                                      ypr[2] * d2r,
                                                      'rzyx')
         self.camera_pose = { 'ned': ned, 'ypr': ypr, 'quat': quat.tolist() }
+        self.pose_version += 1
 
     # set the camera pose using rvec, tvec (rodrigues) which is the
     # output of certain cv2 functions like solvePnP()
@@ -500,6 +683,7 @@ class Image():
                                                      ypr[2] * d2r,
                                                      'rzyx')
         self.camera_pose_sba = { 'ned': ned, 'ypr': ypr, 'quat': quat.tolist() }
+        self.pose_version += 1
 
     def get_camera_pose_sba(self):
         p = self.camera_pose_sba
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+# ImagePipeline.py - decode and preprocess images ahead of time on a
+# few reader threads so disk reads and jpeg decodes overlap with the
+# (cpu bound) consumer, i.e. feature detection.
+#
+#   pipeline = ImagePipeline.ImagePipeline(image_list, readers=2, depth=4)
+#   for image, gray in pipeline:
+#       ...
+#   pipeline.report()
+#
+# Images come out in the original order.  At most 'depth' decoded
+# images are held (decoded or in progress) at any time, so memory use
+# stays bounded no matter how far the readers could run ahead.  The
+# heavy lifting in load_gray() happens inside opencv which releases the
+# GIL, so plain threads are enough here.
+
+import threading
+import time
+
+class ImagePipeline():
+    def __init__(self, image_list, readers=2, depth=4, scale=1.0):
+        self.image_list = image_list
+        self.scale = scale      # load_gray() scale (reduced resolution decode)
+        self.readers = max(1, readers)
+        self.depth = max(1, depth)
+        self.slots = threading.Semaphore(self.depth)
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.next_index = 0     # next image to hand to a reader
+        self.results = {}       # index -> decoded gray image
+        self.threads = []
+        self.stopped = False
+
+        # stage statistics
+        self.read_time = 0.0    # total reader time spent decoding
+        self.blocked_time = 0.0 # total reader time waiting for a free slot
+        self.starved_time = 0.0 # consumer time waiting for a decode
+        self.occupancy_sum = 0  # decoded images waiting, summed per get
+        self.gets = 0
+        self.start_time = None
+        self.end_time = None
+
+    def start(self):
+        self.start_time = time.time()
+        for i in range(min(self.readers, len(self.image_list))):
+            t = threading.Thread(target=self.reader)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def reader(self):
+        while True:
+            t0 = time.time()
+            self.slots.acquire()
+            t1 = time.time()
+            with self.lock:
+                self.blocked_time += t1 - t0
+                index = self.next_index
+                self.next_index += 1
+            if self.stopped or index >= len(self.image_list):
+                self.slots.release()
+                return
+            gray = self.image_list[index].load_gray(self.scale)
+            t2 = time.time()
+            with self.lock:
+                self.read_time += t2 - t1
+                self.results[index] = gray
+                self.ready.notify_all()
+
+    # return the decoded gray image for image_list[index] (images must
+    # be requested in order)
+    def get(self, index):
+        t0 = time.time()
+        with self.lock:
+            self.occupancy_sum += len(self.results)
+            self.gets += 1
+            while not index in self.results:
+                self.ready.wait()
+            gray = self.results.pop(index)
+            self.starved_time += time.time() - t0
+        self.slots.release()
+        return gray
+
+    def __iter__(self):
+        if not len(self.threads):
+            self.start()
+        for i, image in enumerate(self.image_list):
+            yield image, self.get(i)
+        self.end_time = time.time()
+
+    # stop the readers early (i.e. the consumer quit part way through)
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.results = {}
+        for t in self.threads:
+            self.slots.release()
+        self.end_time = time.time()
+
+    def stats(self):
+        if self.end_time:
+            elapsed = self.end_time - self.start_time
+        elif self.start_time:
+            elapsed = time.time() - self.start_time
+        else:
+            elapsed = 0.0
+        if self.gets > 0:
+            occupancy = float(self.occupancy_sum) / self.gets
+        else:
+            occupancy = 0.0
+        if elapsed > 0.0:
+            reader_busy = self.read_time / (elapsed * self.readers)
+            consumer_starved = self.starved_time / elapsed
+        else:
+            reader_busy = 0.0
+            consumer_starved = 0.0
+        return { 'images': self.gets,
+                 'elapsed': elapsed,
+                 'readers': self.readers,
+                 'depth': self.depth,
+                 'reader-busy': reader_busy,
+                 'reader-blocked': self.blocked_time,
+                 'consumer-starved': consumer_starved,
+                 'queue-occupancy': occupancy }
+
+    def report(self):
+        s = self.stats()
+        print "Image pipeline: %d images in %.1f sec (%d readers, depth %d)" \
+            % (s['images'], s['elapsed'], s['readers'], s['depth'])
+        print "  readers: %.0f%% busy decoding, %.1f sec blocked on a full queue" \
+            % (s['reader-busy'] * 100.0, s['reader-blocked'])
+        print "  queue: %.1f decoded images waiting on average" \
+            % (s['queue-occupancy'])
+        print "  consumer: %.0f%% of the time waiting on decodes" \
+            % (s['consumer-starved'] * 100.0)
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+
+# JpegProbe.py - read the pixel dimensions (and exif orientation) of a
+# jpeg image from its headers without decoding any of the image data.
+#
+# Only the marker segments in front of the first frame header (SOF)
+# are read, which is typically a few kb even for very large images.
+
+import struct
+
+# start of frame markers (all of the SOFn except DHT, JPG and DAC)
+sof_markers = set([ 0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF ])
+# markers without a length field
+standalone_markers = set([ 0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6,
+                           0xD7, 0xD8 ])
+
+# return the exif orientation tag (1-8) from the contents of an APP1
+# segment, or None if not present
+def exif_orientation(data):
+    if data[:6] != 'Exif\x00\x00':
+        return None
+    tiff = data[6:]
+    if tiff[:2] == 'II':
+        endian = '<'
+    elif tiff[:2] == 'MM':
+        endian = '>'
+    else:
+        return None
+    try:
+        (ifd_offset,) = struct.unpack(endian + 'I', tiff[4:8])
+        (count,) = struct.unpack(endian + 'H', tiff[ifd_offset:ifd_offset+2])
+        for i in range(count):
+            entry = ifd_offset + 2 + 12*i
+            (tag, type, n) = struct.unpack(endian + 'HHI', tiff[entry:entry+8])
+            if tag == 0x0112:
+                (value,) = struct.unpack(endian + 'H', tiff[entry+8:entry+10])
+                return value
+    except struct.error:
+        # truncated or malformed exif block
+        return None
+    return None
+
+# return (width, height, orientation) for a jpeg file, or None if the
+# file isn't a jpeg or the headers can't be parsed (orientation is 1
+# when there is no exif orientation tag.)
+def probe(filename):
+    try:
+        f = open(filename, 'rb')
+    except IOError:
+        return None
+    orientation = 1
+    result = None
+    try:
+        if f.read(2) != '\xFF\xD8':
+            return None
+        while True:
+            byte = f.read(1)
+            if byte == '':
+                break
+            if byte != '\xFF':
+                # not at a marker (corrupt file)
+                break
+            marker = ord(f.read(1) or '\x00')
+            while marker == 0xFF:
+                # fill bytes
+                marker = ord(f.read(1) or '\x00')
+            if marker in standalone_markers:
+                continue
+            if marker == 0xD9 or marker == 0xDA or marker == 0x00:
+                # end of image or start of scan before any frame header
+                break
+            header = f.read(2)
+            if len(header) < 2:
+                break
+            (length,) = struct.unpack('>H', header)
+            if length < 2:
+                break
+            if marker in sof_markers:
+                data = f.read(5)
+                if len(data) < 5:
+                    break
+                (precision, height, width) = struct.unpack('>BHH', data)
+                if width == 0 or height == 0:
+                    break
+                result = (width, height, orientation)
+                break
+            elif marker == 0xE1:
+                value = exif_orientation(f.read(length - 2))
+                if value != None:
+                    orientation = value
+            else:
+                f.seek(length - 2, 1)
+    finally:
+        f.close()
+    return result
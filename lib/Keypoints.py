@@ -0,0 +1,202 @@
+#!/usr/bin/python
+
+# Keypoints.py - compact binary (numpy structured array) storage for
+# the keypoints of an image.  Replaces the original pickled list of
+# python tuples which required building every cv2.KeyPoint in a python
+# loop at load time, and provides an array backed stand in for the
+# in memory list of cv2.KeyPoint's.
+
+import collections
+import cPickle as pickle
+import cv2
+import json
+import numpy as np
+import os.path
+import sys
+
+# Binary keypoint record layouts, by format version.  The .npy header
+# stores the full dtype description so the version of any file on disk
+# can be recognized by its dtype alone.  If the layout ever needs to
+# change, add a new version here (never edit an existing one) and teach
+# load() how to convert the older layout forward.
+kp_dtype_v1 = np.dtype([ ('x', '<f4'),
+                         ('y', '<f4'),
+                         ('size', '<f4'),
+                         ('angle', '<f4'),
+                         ('response', '<f4'),
+                         ('octave', '<i4'),
+                         ('class_id', '<i4') ])
+kp_versions = { 1: kp_dtype_v1 }
+KP_FORMAT_VERSION = 1
+kp_dtype = kp_versions[KP_FORMAT_VERSION]
+
+# return the format version of the given keypoint array (or None if
+# the layout isn't recognized)
+def format_version(kp_array):
+    for version in kp_versions:
+        if kp_array.dtype == kp_versions[version]:
+            return version
+    return None
+
+# convert a list of native opencv keypoints to a keypoint array
+def from_cv2(kp_list):
+    rows = [ (kp.pt[0], kp.pt[1], kp.size, kp.angle, kp.response,
+              kp.octave, kp.class_id) for kp in kp_list ]
+    return np.array(rows, dtype=kp_dtype)
+
+# convert the original pickle format, a list of (pt, size, angle,
+# response, octave, class_id) tuples, to a keypoint array
+def from_tuples(feature_list):
+    rows = [ (p[0][0], p[0][1], p[1], p[2], p[3], p[4], p[5])
+             for p in feature_list ]
+    return np.array(rows, dtype=kp_dtype)
+
+# convert the original json format to a keypoint array
+def from_json_dict(feature_dict):
+    rows = []
+    for kp_dict in feature_dict['features']:
+        pt = kp_dict['pt']
+        rows.append( (pt[0], pt[1], kp_dict['size'], kp_dict['angle'],
+                      kp_dict['response'], kp_dict['octave'],
+                      kp_dict['class-id']) )
+    return np.array(rows, dtype=kp_dtype)
+
+# build native opencv keypoints from a keypoint array (only needed when
+# handing keypoints to opencv, i.e. drawing.)  Coordinates may be
+# scaled by the optional scale factor.
+def to_cv2(kp_array, scale=1.0):
+    kp_list = []
+    for (x, y, size, angle, response, octave, class_id) in kp_array.tolist():
+        kp_list.append( cv2.KeyPoint(x * scale, y * scale, size, angle,
+                                     response, octave, class_id) )
+    return kp_list
+
+# map keypoints detected on a reduced resolution image (1/factor of
+# the full size) back to full image pixel coordinates.  Pixel centers
+# are aligned, i.e. reduced pixel i covers full pixels [i*factor,
+# (i+1)*factor).
+def rescale(kp_array, factor):
+    kp_array = np.array(kp_array, dtype=kp_dtype)
+    kp_array['x'] = (kp_array['x'] + 0.5) * factor - 0.5
+    kp_array['y'] = (kp_array['y'] + 0.5) * factor - 0.5
+    kp_array['size'] *= factor
+    return kp_array
+
+def save(filename, kp_array):
+    np.save(filename, np.asarray(kp_array, dtype=kp_dtype))
+
+# load a keypoint array.  Read into memory by default: a per image file
+# is small, and every memory map holds an open file, so mapping one per
+# image runs out of file handles on large projects.  mmap_mode='r'
+# maps it read only (for one off use of a single large file.)
+def load(filename, mmap_mode=None):
+    kp_array = np.load(filename, mmap_mode=mmap_mode)
+    version = format_version(kp_array)
+    if version == None:
+        raise ValueError("unknown keypoint layout: " + str(kp_array.dtype))
+    return kp_array
+
+# load one of the original feature file formats (pickled tuples first,
+# then the older json) and return a keypoint array
+def load_legacy(filename):
+    try:
+        feature_list = pickle.load( open( filename, "rb" ) )
+        return from_tuples(feature_list)
+    except:
+        # unpickle failed, try old style json
+        f = open(filename, 'r')
+        feature_dict = json.load(f)
+        f.close()
+        return from_json_dict(feature_dict)
+
+# convert an original format feature file to the binary format in
+# place.  Returns the number of keypoints converted or -1 on error.
+def upgrade_file(legacy_file, kp_file, remove_legacy=False):
+    try:
+        kp_array = load_legacy(legacy_file)
+        save(kp_file, kp_array)
+    except:
+        print legacy_file + ":\n" + "  upgrade error: " \
+            + str(sys.exc_info()[0]) + ": " + str(sys.exc_info()[1])
+        return -1
+    if remove_legacy:
+        os.remove(legacy_file)
+    return len(kp_array)
+
+# a lightweight, read only stand in for a single cv2.KeyPoint (for the
+# many places that just need kp.pt and friends.)
+Keypoint = collections.namedtuple('Keypoint', [ 'pt', 'size', 'angle',
+                                                'response', 'octave',
+                                                'class_id' ])
+
+# An array backed replacement for the list of cv2.KeyPoint objects that
+# used to live in image.kp_list.  It can be indexed and iterated like
+# the original list, but only builds native opencv keypoints on demand
+# (to_cv2()) for the few calls that actually need them (i.e. drawing.)
+class KeypointList():
+    def __init__(self, kp_array=None):
+        if kp_array is None:
+            kp_array = np.zeros(0, dtype=kp_dtype)
+        self.kp_array = kp_array
+
+    def __len__(self):
+        return len(self.kp_array)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, long, np.integer)):
+            (x, y, size, angle, response, octave, class_id) \
+                = self.kp_array[index].tolist()
+            return Keypoint((x, y), size, angle, response, octave, class_id)
+        else:
+            # slice, index array, or boolean mask
+            return KeypointList(self.kp_array[index])
+
+    def __iter__(self):
+        for (x, y, size, angle, response, octave, class_id) \
+            in self.kp_array.tolist():
+            yield Keypoint((x, y), size, angle, response, octave, class_id)
+
+    # Nx2 float32 array of keypoint (x, y) locations
+    @property
+    def pts(self):
+        pts = np.empty( (len(self.kp_array), 2), dtype=np.float32 )
+        pts[:,0] = self.kp_array['x']
+        pts[:,1] = self.kp_array['y']
+        return pts
+
+    @property
+    def size(self):
+        return self.kp_array['size']
+
+    @property
+    def angle(self):
+        return self.kp_array['angle']
+
+    @property
+    def response(self):
+        return self.kp_array['response']
+
+    @property
+    def octave(self):
+        return self.kp_array['octave']
+
+    @property
+    def class_id(self):
+        return self.kp_array['class_id']
+
+    # build native opencv keypoints for all (or the selected indices)
+    def to_cv2(self, indices=None, scale=1.0):
+        if indices is None:
+            return to_cv2(self.kp_array, scale)
+        else:
+            return to_cv2(self.kp_array[np.asarray(indices, dtype=int)], scale)
+
+# return the keypoint array behind a KeypointList (or a plain list of
+# cv2.KeyPoint's)
+def as_array(kp_list):
+    if isinstance(kp_list, KeypointList):
+        return kp_list.kp_array
+    elif isinstance(kp_list, np.ndarray):
+        return kp_list
+    else:
+        return from_cv2(kp_list)
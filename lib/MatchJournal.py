@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+# MatchJournal.py - an append-only record of the image pairs that have
+# finished matching, so a long matching run that crashes (or is
+# preempted) can pick up where it left off instead of starting over.
+#
+# Each completed pair is written as one json line:
+#
+#   { "pair": [name1, name2], "params": <hash>, "images": [fp1, fp2],
+#     "matches1": [[a, b], ...], "matches2": [[b, a], ...],
+#     "geometry": { model fit summary, see Matcher.verifyPair() } }
+#
+# "params" fingerprints the detector and matcher parameters the pair
+# was matched with.  "images" fingerprints each image's keypoints (the
+# matches index into them, and redetected features usually have the
+# same count since detectors are capped at max-features) and camera
+# pose (which decides the projected overlap the pair was matched
+# with), so results from a different configuration, since redetected
+# features, or a moved camera are never reused.  Pairs are keyed by image
+# name, not index, so adding or removing images doesn't invalidate the
+# rest of the journal.  A pair that appears more than once (i.e. it
+# was restarted) takes its last entry.  The matches are recorded before
+# cullShortMatches() so a resumed run may use a different --min-pairs.
+
+import fnmatch
+import hashlib
+import json
+import numpy as np
+import os
+import time
+
+class MatchJournal():
+    # params: dictionary of everything that affects the match results.
+    # resume: reuse the pairs already in the journal (otherwise it is
+    # started over.)  restart_pairs: list of image names (or shell
+    # patterns), any journaled pair involving a matching image is
+    # matched again.
+    def __init__(self, project_dir, params, resume=False, restart_pairs=[]):
+        self.journal_file = project_dir + "/matches.journal"
+        canon = json.dumps(params, sort_keys=True, default=str)
+        self.params_hash = hashlib.sha1(canon).hexdigest()
+        self.restart_pairs = restart_pairs
+        self.done = {}          # (name1, name2) -> journal entry
+        self.fingerprints = {}  # image name -> fingerprint (this run)
+        self.stale = 0
+        self.last_sync = time.time()
+        if resume:
+            self.read()
+            need_newline = os.path.exists(self.journal_file) \
+                and os.path.getsize(self.journal_file) > 0 \
+                and not self.ends_with_newline()
+            self.f = open(self.journal_file, 'a')
+            if need_newline:
+                # a crash in the middle of a write left a partial last
+                # line, don't glue the next entry onto it
+                self.f.write('\n')
+        else:
+            self.f = open(self.journal_file, 'w')
+
+    def ends_with_newline(self):
+        f = open(self.journal_file, 'rb')
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.close()
+        return last == '\n'
+
+    def read(self):
+        if not os.path.exists(self.journal_file):
+            return
+        f = open(self.journal_file, 'r')
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # partially written entry (the run was killed mid write)
+                continue
+            if entry.get('params') != self.params_hash:
+                self.stale += 1
+                continue
+            self.done[tuple(entry['pair'])] = entry
+        f.close()
+        print "Match journal: %d pairs done, %d from different parameters" \
+            % (len(self.done), self.stale)
+
+    def restarted(self, name):
+        for pattern in self.restart_pairs:
+            if fnmatch.fnmatch(name, pattern):
+                return True
+        return False
+
+    # sha1 of the image's keypoints and camera pose.  Neither changes
+    # during a matching run so it is computed once per image.
+    def fingerprint(self, image):
+        if not image.name in self.fingerprints:
+            h = hashlib.sha1()
+            kp_array = np.ascontiguousarray(image.kp_list.kp_array)
+            h.update(kp_array.tostring())
+            h.update(json.dumps(image.camera_pose, sort_keys=True))
+            self.fingerprints[image.name] = h.hexdigest()
+        return self.fingerprints[image.name]
+
+    # return the journaled (matches1, matches2, geometry) of the pair or
+    # None if it needs to be matched
+    def lookup(self, i1, i2):
+        entry = self.done.get( (i1.name, i2.name) )
+        if entry == None:
+            return None
+        if entry.get('images') != [self.fingerprint(i1), self.fingerprint(i2)]:
+            return None
+        if self.restarted(i1.name) or self.restarted(i2.name):
+            return None
+        return entry['matches1'], entry['matches2'], entry.get('geometry')
+
+    # index pairs as plain python ints (for json)
+    def plain(self, matches):
+        return np.asarray(matches, dtype=int).reshape(-1, 2).tolist()
+
+    def record(self, i1, i2, matches1, matches2, geometry=None):
+        entry = { 'pair': [i1.name, i2.name],
+                  'params': self.params_hash,
+                  'images': [self.fingerprint(i1), self.fingerprint(i2)],
+                  'matches1': self.plain(matches1),
+                  'matches2': self.plain(matches2),
+                  'geometry': geometry }
+        self.f.write(json.dumps(entry) + '\n')
+        self.f.flush()
+        # flush to the disk itself every few seconds, not every pair
+        if time.time() - self.last_sync > 5.0:
+            os.fsync(self.f.fileno())
+            self.last_sync = time.time()
+
+    def close(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+
+# MatchMetrics.py - one structured record per matched image pair,
+# written as json lines to <project>/match-metrics.jsonl so matching
+# runs can be inspected and compared after the fact (i.e. loaded with
+# pandas.read_json(filename, lines=True)) instead of read back from the
+# console.
+#
+# Each record holds the pair, how many features survived each stage
+# and the time spent in each stage (seconds):
+#
+#   candidates   [n1, n2] features inside the other image's bounding
+#                sphere (the kdtree pre-filter, or all features)
+#   knn          [forward, reverse] raw knn matches
+#   ratio        [forward, reverse] matches after the ratio test
+#   reciprocal   matches found in both directions
+#   inliers      matches consistent with the pair geometry
+#   inlier-ratio inliers / reciprocal
+#   time-prefilter, time-knn, time-ratio, time-verify, time-total
+
+import json
+import os
+import time
+
+class MatchMetrics():
+    # append to the existing file (i.e. a resumed run) or start over
+    def __init__(self, project_dir, append=False):
+        self.metrics_file = project_dir + "/match-metrics.jsonl"
+        self.run = time.strftime("%Y-%m-%d %H:%M:%S")
+        if append:
+            self.f = open(self.metrics_file, 'a')
+        else:
+            self.f = open(self.metrics_file, 'w')
+        self.count = 0
+
+    def record(self, i1, i2, metrics):
+        entry = dict(metrics)
+        entry['pair'] = [i1.name, i2.name]
+        entry['run'] = self.run
+        geometry = entry.pop('geometry', None)
+        if geometry:
+            # the model itself lives in the match journal
+            entry['filter'] = geometry['filter']
+            entry['reciprocal'] = geometry['reciprocal']
+            entry['inliers'] = geometry['inliers']
+            entry['inlier-ratio'] = geometry['inlier-ratio']
+        self.f.write(json.dumps(entry, sort_keys=True) + '\n')
+        self.f.flush()
+        self.count += 1
+
+    def close(self):
+        self.f.close()
+        print "Wrote %d pair records to %s" % (self.count, self.metrics_file)
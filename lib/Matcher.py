@@ -2,19 +2,76 @@ import copy
 import cv2
 import math
 from matplotlib import pyplot as plt
+import multiprocessing
 import numpy as np
+import time
 
 from find_obj import filter_matches,explore_match
+import CandidatePairs
+import CascadeHash
+import DescriptorCache
+import FeatureIndex
+import GeometricVerify
+import HammingMatcher
 import ImageList
 import transformations
 
 
+# convert knnMatch (k=2) results to arrays: the query index (N,), the
+# two best train indices (N,2) and their distances (N,2) for every
+# query that found two neighbors
+def knn_arrays(matches):
+    rows = [ (m[0].queryIdx, m[0].trainIdx, m[1].trainIdx,
+              m[0].distance, m[1].distance)
+             for m in matches if len(m) == 2 ]
+    a = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    query = a[:,0].astype(int)
+    train = a[:,1:3].astype(int)
+    dist = a[:,3:5]
+    return query, train, dist
+
+# Parallel pair matching.  The worker processes are forked after
+# pair_worker is filled in, so they inherit the matcher and the image
+# list (keypoints, coord_lists, kdtrees) without pickling any of it.
+# Each worker loads descriptors through its own descriptor cache and
+# hands back just the surviving index pairs.
+pair_worker = {}
+
+def match_pair_worker(pair):
+    (i, j) = pair
+    m = pair_worker['matcher']
+    image_list = pair_worker['image_list']
+    des_cache = pair_worker['des_cache']
+    i1 = image_list[i]
+    i2 = image_list[j]
+    if des_cache:
+        des_cache.get(i1)
+        des_cache.get(i2)
+    metrics = m.matchPair(image_list, i, j, *pair_worker['args'])
+    matches1 = np.array(i1.match_list[j], dtype=np.int32).reshape(-1, 2)
+    matches2 = np.array(i2.match_list[i], dtype=np.int32).reshape(-1, 2)
+    # the parent keeps the results, don't accumulate them here
+    i1.match_list[j] = []
+    i2.match_list[i] = []
+    return i, j, matches1, matches2, metrics
+
+
 class Matcher():
     def __init__(self):
         self.image_list = []
         self.matcher = None
+        self.feature_index = None # per image flann indices (if used)
+        self.knn_engine = None  # numpy knn matcher (HammingMatcher or CascadeHash)
+        # pairs found by appearance (see VocabTree.py) which are matched
+        # using all their keypoints, not just the projected overlap
+        self.visual_pairs = set()
         self.match_ratio = 0.75
         self.min_pairs = 2      # minimum number of pairs to consider a match
+        self.verify_method = 'ransac' # robust estimator (see GeometricVerify.py)
+        self.verify_confidence = 0.999
+        self.pair_geometry = {} # (i, j) -> model fit summary of the pair
+        self.metrics = None     # counts and timings of the current pair
+        self.debug_plots = False # write gnuplot files (c1.txt, etc.) per pair
         #self.bf = cv2.BFMatcher(cv2.NORM_HAMMING) #, crossCheck=True)
         #self.bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
 
@@ -43,40 +100,67 @@ class Matcher():
                                      'multi_probe_level': 1 #2
                                      }
                 self.matcher = cv2.FlannBasedMatcher(flann_params, {}) # bug : need to pass empty dict (#1329)
+                if mparams.get('feature-index', False):
+                    # build (or load) one index per image and reuse it
+                    # for all of the image's pairs
+                    self.feature_index = FeatureIndex.FeatureIndex(flann_params, norm)
             elif mparams['matcher'] == 'BF':
                 print "brute force norm = %d" % norm
                 self.matcher = cv2.BFMatcher(norm)
+            elif mparams['matcher'] == 'Hamming':
+                if norm == cv2.NORM_HAMMING:
+                    self.knn_engine = HammingMatcher.HammingMatcher()
+                else:
+                    print "Hamming matcher needs binary descriptors, using brute force"
+                self.matcher = cv2.BFMatcher(norm)
+            elif mparams['matcher'] == 'Cascade':
+                if norm == cv2.NORM_L2:
+                    self.knn_engine = CascadeHash.CascadeHash(
+                        bits=mparams.get('cascade-bits', 128),
+                        candidates=mparams.get('cascade-candidates', 10))
+                else:
+                    print "Cascade hashing needs float descriptors, using brute force"
+                self.matcher = cv2.BFMatcher(norm)
         if 'match-ratio' in mparams:
             self.match_ratio = mparams['match-ratio']
+        if 'verify-method' in mparams:
+            self.verify_method = mparams['verify-method']
+        if 'verify-confidence' in mparams:
+            self.verify_confidence = mparams['verify-confidence']
 
     def setImageList(self, image_list):
         self.image_list = image_list
 
-    def filter_by_feature(self, i1, i2, matches):
-        kp1 = i1.kp_list
-        kp2 = i2.kp_list
-        mkp1, mkp2 = [], []
-        idx_pairs = []
-        used = np.zeros(len(kp2), np.bool_)
-        for m in matches:
-            if len(m) != 2:
-                # we asked for the two best matches
-                continue
-            #print "dist = %.2f %.2f (%.2f)" % (m[0].distance, m[1].distance, m[0].distance/m[1].distance)
-            if m[0].distance > m[1].distance * self.match_ratio:
-                # must pass the feature vector distance ratio test
-                continue
-
-            m = m[0]
-            if not used[m.trainIdx]:
-                used[m.trainIdx] = True
-                mkp1.append( kp1[m.queryIdx] )
-                mkp2.append( kp2[m.trainIdx] )
-                idx_pairs.append( [m.queryIdx, m.trainIdx] )
-        p1 = np.float32([kp.pt for kp in mkp1])
-        p2 = np.float32([kp.pt for kp in mkp2])
-        kp_pairs = zip(mkp1, mkp2)
-        return p1, p2, kp_pairs, idx_pairs
+    # Run the classic feature distance ratio test on knnMatch (k=2)
+    # results, then keep only the first match to use each train
+    # feature.  result1/result2 (if given) map the query/train indices
+    # of a subset match back to the full keypoint lists.  Returns an
+    # Nx2 int array of (query, train) index pairs.
+    def filter_by_feature(self, i1, i2, matches, result1=None, result2=None):
+        query, train, dist = knn_arrays(matches)
+        return self.filter_knn(query, train, dist, result1, result2)
+
+    # the array version of filter_by_feature().  If allowed is given,
+    # only matches whose best train index is in allowed are kept.
+    def filter_knn(self, query, train, dist, result1=None, result2=None,
+                   allowed=None):
+        # must pass the feature vector distance ratio test
+        keep = dist[:,0] <= dist[:,1] * self.match_ratio
+        if allowed is not None:
+            keep &= np.in1d(train[:,0], allowed)
+        query = query[keep]
+        train = train[keep,0]
+        # first come, first served: the earliest query to pick a train
+        # feature gets it
+        u, first = np.unique(train, return_index=True)
+        first.sort()
+        query = query[first]
+        train = train[first]
+        if result1 is not None:
+            query = np.asarray(result1, dtype=int)[query]
+        if result2 is not None:
+            train = np.asarray(result2, dtype=int)[train]
+        return np.column_stack( (query, train) ).reshape(-1, 2)
 
     def filter_by_location(self, i1, i2, idx_pairs, dist):
         result = []
@@ -90,108 +174,6 @@ class Matcher():
             result.append(pair)
         return result
 
-    # Iterate through all the matches for the specified image and
-    # delete keypoints that don't satisfy the homography (or
-    # fundamental) relationship.  Returns true if match set is clean, false
-    # if keypoints were removed.
-    #
-    # Notice: this tends to eliminate matches that aren't all on the
-    # same plane, so if the scene has a lot of depth, this could knock
-    # out a lot of good matches.
-    def filter_by_homography(self, K, i1, i2, j, filter):
-        clean = True
-        
-        tol = float(i1.width) / 100.0 # rejection range in pixels
-        if tol < 1.0:
-            tol = 1.0
-        # print "tol = %.4f" % tol 
-        matches = i1.match_list[j]
-        if len(matches) < self.min_pairs:
-            i1.match_list[j] = []
-            return True
-        p1 = []
-        p2 = []
-        for k, pair in enumerate(matches):
-            use_raw_uv = False
-            if use_raw_uv:
-                p1.append( i1.kp_list[pair[0]].pt )
-                p2.append( i2.kp_list[pair[1]].pt )
-            else:
-                # undistorted uv points should be better, right?
-                p1.append( i1.uv_list[pair[0]] )
-                p2.append( i2.uv_list[pair[1]] )
-
-        p1 = np.float32(p1)
-        p2 = np.float32(p2)
-        #print "p1 = %s" % str(p1)
-        #print "p2 = %s" % str(p2)
-        if filter == "homography":
-            #method = cv2.RANSAC
-            method = cv2.LMEDS
-            M, status = cv2.findHomography(p1, p2, method, tol)
-        elif filter == "fundamental":
-            # method = cv2.FM_RANSAC     
-            method = cv2.FM_LMEDS
-            M, status = cv2.findFundamentalMat(p1, p2, method, tol)
-        elif filter == "essential":
-            # method = cv2.FM_RANSAC     
-            method = cv2.FM_LMEDS
-            M, status = cv2.findEssentialMat(p1, p2, K, method, threshold=tol)
-        elif filter == "none":
-            status = np.ones(len(matches))
-        else:
-            # fail
-            M, status = None, None
-        print '%s vs %s: %d / %d  inliers/matched' \
-            % (i1.name, i2.name, np.sum(status), len(status))
-        # remove outliers
-        for k, flag in enumerate(status):
-            if not flag:
-                print "    deleting: " + str(matches[k])
-                clean = False
-                matches[k] = (-1, -1)
-        for pair in reversed(matches):
-            if pair == (-1, -1):
-                matches.remove(pair)
-        return clean
-
-    def filter_non_reciprocal_pair(self, image_list, i, j):
-        clean = True
-        i1 = image_list[i]
-        i2 = image_list[j]
-        #print "testing %i vs %i" % (i, j)
-        matches = i1.match_list[j]
-        rmatches = i2.match_list[i]
-        before = len(matches)
-        for k, pair in enumerate(matches):
-            rpair = [pair[1], pair[0]]
-            found = False
-            for r in rmatches:
-                #print "%s - %s" % (rpair, r)
-                if rpair == r:
-                    found = True
-                    break
-            if not found:
-                #print "not found =", rpair
-                matches[k] = [-1, -1]
-        for pair in reversed(matches):
-            if pair == [-1, -1]:
-                matches.remove(pair)
-        after = len(matches)
-        if before != after:
-            clean = False
-            print "  (%d vs. %d) matches %d -> %d" % (i, j, before, after)
-        return clean
-
-    def filter_non_reciprocal(self, image_list):
-        clean = True
-        print "Removing non-reciprocal matches:"
-        for i, i1 in enumerate(image_list):
-            for j, i2 in enumerate(image_list):
-                if not filter_non_reciprocal_pair(image_list, i, j):
-                    clean = False
-        return clean
-
     # Iterative Closest Point algorithm
     def ICP(self, i1, i2):
         if i1 == i2:
@@ -287,24 +269,54 @@ class Matcher():
 
     def basic_matches(self, i1, i2, des_list1, des_list2,
                       result1, result2, feature_fuzz):
-        # all vs. all match between overlapping i1 keypoints and i2
-        # keypoints (forward match)
-        matches = self.matcher.knnMatch(np.array(des_list1),
-                                        trainDescriptors=np.array(des_list2),
-                                        k=2)
-        # rewrite the query/train indices (from our query subset)
-        # back to referencing the full set of keypoints
-        for match in matches:
-            for m in match:
-                qi = m.queryIdx
-                m.queryIdx = result1[qi]
-                ti = m.trainIdx
-                m.trainIdx = result2[ti]
-        print "initial matches =", len(matches)
-        
-        # run the classic feature distance ratio test
-        p1, p2, kp_pairs, idx_pairs = self.filter_by_feature(i1, i2, matches)
-        print "after distance ratio test =", len(idx_pairs)
+        t0 = time.time()
+        if self.knn_engine:
+            # numpy (hamming or cascade hash) match between the
+            # overlapping keypoints (forward match)
+            train, dist = self.knn_engine.knn(des_list1, des_list2, k=2)
+            t1 = time.time()
+            # only queries with two neighbors can take the ratio test
+            ok = train[:,1] >= 0
+            query = np.arange(len(train))[ok]
+            n_knn = len(query)
+            print "initial matches =", len(query)
+            idx_pairs = self.filter_knn(query, train[ok], dist[ok],
+                                        result1, result2)
+            print "after distance ratio test =", len(idx_pairs)
+        elif self.feature_index:
+            # overlapping i1 keypoints vs. the index of all i2
+            # keypoints, keeping only matches that land on an
+            # overlapping i2 keypoint (the 2nd neighbor for the ratio
+            # test may come from anywhere in i2, so ambiguous features
+            # are rejected even if their twin is outside the overlap)
+            train, dist = self.feature_index.knn(i2, des_list1, k=2)
+            t1 = time.time()
+            query = np.arange(len(train))
+            n_knn = len(train)
+            print "initial matches =", len(train)
+            idx_pairs = self.filter_knn(query, train, dist, result1,
+                                        allowed=result2)
+            print "after distance ratio test =", len(idx_pairs)
+        else:
+            # all vs. all match between overlapping i1 keypoints and i2
+            # keypoints (forward match)
+            matches = self.matcher.knnMatch(np.array(des_list1),
+                                            trainDescriptors=np.array(des_list2),
+                                            k=2)
+            t1 = time.time()
+            n_knn = len(matches)
+            print "initial matches =", len(matches)
+
+            # run the classic feature distance ratio test (and map the
+            # query/train indices from our subsets back to the full set
+            # of keypoints)
+            idx_pairs = self.filter_by_feature(i1, i2, matches, result1,
+                                               result2)
+            print "after distance ratio test =", len(idx_pairs)
+        self.add_time('time-knn', t1 - t0)
+        self.add_time('time-ratio', time.time() - t1)
+        self.add_count('knn', n_knn)
+        self.add_count('ratio', len(idx_pairs))
 
         do_direct_geo_individual_distance_test = False
         if do_direct_geo_individual_distance_test:
@@ -317,11 +329,13 @@ class Matcher():
         if len(idx_pairs) < self.min_pairs:
             idx_pairs = []
         print "  pairs =", len(idx_pairs)
-        return idx_pairs
+        # match_list entries are lists of [i1 index, i2 index] pairs
+        return np.asarray(idx_pairs, dtype=int).reshape(-1, 2).tolist()
     
     # do initial feature matching of specified image against every
     # image in the provided image list (except self)
-    # fuzz units is meters
+    # fuzz units is meters.  image_fuzz=None matches all the keypoints
+    # of the two images (ignoring the projected overlap)
     def hybridImageMatches(self, i1, i2, image_fuzz=40, feature_fuzz=20, review=False):
         if i1 == i2:
             print "We shouldn't see this, but i1 == i2"
@@ -332,20 +346,29 @@ class Matcher():
             size = 0
 
         # all the points in image1 that are within range of image2
-        if i1.kdtree != None:
+        t0 = time.time()
+        if image_fuzz == None:
+            result1 = range(len(i1.des_list))
+        elif i1.kdtree != None:
             result1 = i1.kdtree.query_ball_point(i2.center,
                                                  i2.radius + image_fuzz)
         else:
             result1 = [], []
+        self.add_count('candidates', len(result1))
         if len(result1) <= 1:
+            self.add_time('time-prefilter', time.time() - t0)
             return [], []
 
         # all the points in image2 that are within range of image1
-        if i2.kdtree != None:
+        if image_fuzz == None:
+            result2 = range(len(i2.des_list))
+        elif i2.kdtree != None:
             result2 = i2.kdtree.query_ball_point(i1.center,
                                                  i1.radius + image_fuzz)
         else:
             result2 = [], []
+        self.add_count('candidates', len(result2))
+        self.add_time('time-prefilter', time.time() - t0)
         if len(result2) <= 1:
             return [], []
 
@@ -369,8 +392,7 @@ class Matcher():
         idx_pairs2 = self.basic_matches( i2, i1, des_list2, des_list1,
                                          result2, result1, feature_fuzz )
 
-        plot_matches = True
-        if plot_matches:
+        if self.debug_plots:
             self.plot_matches(i1, i2, idx_pairs1)
             self.plot_matches(i2, i1, idx_pairs2)
             
@@ -419,43 +441,199 @@ class Matcher():
         # a = raw_input("Press Enter to continue...")
  
 
-    def robustGroupMatches(self, image_list, K, filter="fundamental",
-                           image_fuzz=40, feature_fuzz=20, review=False):
-        n = len(image_list) - 1
-        n_work = float(n*(n+1)/2)
+    # find basic matches between images i and j, filter by match ratio
+    # and ned location, then keep the reciprocal matches that fit the
+    # pair geometry.  The pair's results only depend on images i and j
+    # (so pairs may be matched in any order, or in parallel.)  Returns
+    # the pair's metrics (counts and timings of each step, see
+    # MatchMetrics.py) including the model fit summary ('geometry'.)
+    def matchPair(self, image_list, i, j, K, filter, image_fuzz,
+                  feature_fuzz, review=False):
+        i1 = image_list[i]
+        i2 = image_list[j]
+        if (i, j) in self.visual_pairs:
+            image_fuzz = None
+        self.metrics = {}
+        t0 = time.time()
+        i1.match_list[j], i2.match_list[i] \
+            = self.hybridImageMatches(i1, i2, image_fuzz, feature_fuzz,
+                                      review)
+        t1 = time.time()
+        geometry = self.verifyPair(image_list, i, j, K, filter)
+        t2 = time.time()
+        metrics = self.metrics
+        self.metrics = None
+        metrics['geometry'] = geometry
+        metrics['time-verify'] = t2 - t1
+        metrics['time-total'] = t2 - t0
+        return metrics
+
+    # accumulate a timing / append a count to the current pair metrics
+    def add_time(self, key, seconds):
+        if self.metrics != None:
+            self.metrics[key] = self.metrics.get(key, 0.0) + seconds
+
+    def add_count(self, key, count):
+        if self.metrics != None:
+            self.metrics.setdefault(key, []).append(count)
+
+    # Symmetric single pass cleanup of the matches between images i
+    # and j: keep the matches found in both directions, fit the pair
+    # model (homography, fundamental, or essential) once to those, and
+    # keep the inliers in both match lists.  Since both directions
+    # then hold the same pairs there is nothing left to iterate on
+    # (this replaces the old reciprocal and homography filters that
+    # were repeated until nothing changed.)  The model and
+    # inlier ratio are recorded in self.pair_geometry.
+    def verifyPair(self, image_list, i, j, K, filter):
+        i1 = image_list[i]
+        i2 = image_list[j]
+        fwd = np.array(i1.match_list[j], dtype=int).reshape(-1, 2)
+        rset = set()
+        for r in i2.match_list[i]:
+            rset.add( (r[1], r[0]) )
+        reciprocal = np.array([ (a, b) in rset for (a, b) in fwd.tolist() ],
+                              dtype=bool)
+        matches = fwd[reciprocal]
+        geometry = { 'filter': filter,
+                     'matches': len(fwd),
+                     'reciprocal': len(matches),
+                     'inliers': 0,
+                     'inlier-ratio': 0.0,
+                     'model': None }
+        if len(matches) >= self.min_pairs:
+            p1 = np.asarray(i1.uv_list)[matches[:,0]]
+            p2 = np.asarray(i2.uv_list)[matches[:,1]]
+            tol = GeometricVerify.tolerance(i1.width)
+            M, mask, ratio \
+                = GeometricVerify.verify(p1, p2, filter, tol, K,
+                                         self.verify_method,
+                                         self.verify_confidence)
+            print '%s vs %s: %d / %d  inliers/matched' \
+                % (i1.name, i2.name, np.count_nonzero(mask), len(mask))
+            matches = matches[mask]
+            geometry['inliers'] = len(matches)
+            geometry['inlier-ratio'] = ratio
+            if M is not None:
+                geometry['model'] = np.asarray(M).tolist()
+        if len(matches) < self.min_pairs:
+            matches = np.zeros( (0, 2), dtype=int )
+        i1.match_list[j] = matches.tolist()
+        i2.match_list[i] = matches[:,::-1].tolist()
+        self.pair_geometry[(i, j)] = geometry
+        return geometry
+
+    # match the pairs across a pool of worker processes.  Pairs are
+    # handed out in (cache friendly) order in small chunks and the
+    # results are stored in pair order, so the outcome is the same as
+    # the serial path no matter how many workers are used.
+    def parallelPairMatches(self, image_list, pairs, K, filter, image_fuzz,
+                            feature_fuzz, des_cache, jobs, journal=None,
+                            metrics_log=None):
+        pair_worker['matcher'] = self
+        pair_worker['image_list'] = image_list
+        pair_worker['args'] = (K, filter, image_fuzz, feature_fuzz)
+        if des_cache:
+            # split the memory budget between the workers
+            pair_worker['des_cache'] \
+                = DescriptorCache.DescriptorCache(des_cache.budget / jobs)
+        else:
+            pair_worker['des_cache'] = None
+        if self.feature_index:
+            # each worker keeps its own resident indices
+            index_budget = self.feature_index.budget
+            self.feature_index.set_budget(index_budget / jobs)
+        chunksize = max(1, min(64, len(pairs) / (jobs * 8)))
+        n_work = float(len(pairs))
         n_count = float(0)
-        
-        # find basic matches and filter by match ratio and ned
-        # location
-        for i, i1 in enumerate(image_list):
-            if len(i1.match_list) == 0:
-                i1.match_list = [[]] * len(image_list)
-
-            for j, i2 in enumerate(image_list):
-                if j <= i:
-                    continue
+        pool = multiprocessing.Pool(jobs)
+        for (i, j, matches1, matches2, metrics) \
+            in pool.imap(match_pair_worker, pairs, chunksize):
+            image_list[i].match_list[j] = matches1.tolist()
+            image_list[j].match_list[i] = matches2.tolist()
+            self.pair_geometry[(i, j)] = metrics['geometry']
+            if journal:
+                journal.record(image_list[i], image_list[j],
+                               image_list[i].match_list[j],
+                               image_list[j].match_list[i],
+                               metrics['geometry'])
+            if metrics_log:
+                metrics_log.record(image_list[i], image_list[j], metrics)
+            n_count += 1
+            print "%.1f %% done" % ((n_count / n_work) * 100.0)
+        pool.close()
+        pool.join()
+        pair_worker.clear()
+        if self.feature_index:
+            self.feature_index.set_budget(index_budget)
+
+    # des_cache: optional DescriptorCache that loads (and evicts)
+    # image descriptors on demand instead of requiring every image's
+    # des_list to be resident.
+    # pairs is the list of (i, j) image index pairs to match, by default
+    # only the pairs whose bounding spheres overlap (within image_fuzz.)
+    # jobs > 1 matches the pairs in that many worker processes.
+    # journal: optional MatchJournal, pairs it already has are restored
+    # instead of matched and every newly matched pair is recorded.
+    # metrics_log: optional MatchMetrics, gets one record per matched
+    # pair.
+    def robustGroupMatches(self, image_list, K, filter="fundamental",
+                           image_fuzz=40, feature_fuzz=20, review=False,
+                           des_cache=None, pairs=None, jobs=1, journal=None,
+                           metrics_log=None):
+        for image in image_list:
+            if len(image.match_list) == 0:
+                image.match_list = [[]] * len(image_list)
+
+        if pairs == None:
+            pairs = CandidatePairs.spatial_pairs(image_list, image_fuzz)
+        n_all = len(image_list) * (len(image_list) - 1) / 2
+        print "Candidate pairs: %d of %d (%d pruned)" \
+            % (len(pairs), n_all, n_all - len(pairs))
+        if journal:
+            todo = []
+            for (i, j) in pairs:
+                result = journal.lookup(image_list[i], image_list[j])
+                if result == None:
+                    todo.append( (i, j) )
+                else:
+                    image_list[i].match_list[j] = result[0]
+                    image_list[j].match_list[i] = result[1]
+                    if result[2] != None:
+                        self.pair_geometry[(i, j)] = result[2]
+            print "Resumed %d pairs from the journal, %d left to match" \
+                % (len(pairs) - len(todo), len(todo))
+            pairs = todo
+        if des_cache:
+            pairs = des_cache.order_pairs(pairs, image_list)
+
+        if jobs > 1 and not review:
+            self.parallelPairMatches(image_list, pairs, K, filter,
+                                     image_fuzz, feature_fuzz, des_cache,
+                                     jobs, journal, metrics_log)
+        else:
+            n_work = float(len(pairs))
+            n_count = float(0)
+            for (i, j) in pairs:
+                i1 = image_list[i]
+                i2 = image_list[j]
                 print "Matching %s vs %s" % (i1.name, i2.name)
-                if len(i2.match_list) == 0:
-                    # create if needed
-                    i2.match_list = [[]] * len(image_list)
-                i1.match_list[j], i2.match_list[i] \
-                    = self.hybridImageMatches(i1, i2, image_fuzz, feature_fuzz,
-                                              review)
+                if des_cache:
+                    des_cache.get(i1)
+                    des_cache.get(i2)
+                metrics = self.matchPair(image_list, i, j, K, filter,
+                                         image_fuzz, feature_fuzz, review)
+                if journal:
+                    journal.record(i1, i2, i1.match_list[j], i2.match_list[i],
+                                   metrics['geometry'])
+                if metrics_log:
+                    metrics_log.record(i1, i2, metrics)
                 n_count += 1
-
-                done = False
-                while not done:
-                    done = True
-                    if not self.filter_non_reciprocal_pair(image_list, i, j):
-                        done = False
-                    if not self.filter_non_reciprocal_pair(image_list, j, i):
-                        done = False
-                    if not self.filter_by_homography(K, i1, i2, j, filter):
-                        done = False
-                    if not self.filter_by_homography(K, i2, i1, i, filter):
-                        done = False
-                        
                 print "%.1f %% done" % ((n_count / n_work) * 100.0)
+            if des_cache:
+                des_cache.report()
+            if self.feature_index:
+                self.feature_index.report()
 
         # so nothing sneaks through
         self.cullShortMatches(image_list)
@@ -512,11 +690,8 @@ class Matcher():
 
     def showMatch(self, i1, i2, idx_pairs, status=None):
         #print " -- idx_pairs = " + str(idx_pairs)
-        kp_pairs = []
-        for p in idx_pairs:
-            kp1 = i1.kp_list[p[0]]
-            kp2 = i2.kp_list[p[1]]
-            kp_pairs.append( (kp1, kp2) )
+        idx = np.array(idx_pairs, dtype=int).reshape(-1, 2)
+        kp_pairs = zip(i1.kp_list.to_cv2(idx[:,0]), i2.kp_list.to_cv2(idx[:,1]))
         img1 = i1.load_gray()
         img2 = i2.load_gray()
         if status == None:
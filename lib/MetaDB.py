@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+# MetaDB.py - a single project level store (sqlite) for the per image
+# meta data that originally lived in one .info json file per image.
+#
+# Each image gets one row holding the same dictionary that was written
+# to its .info file (poses, biases, size, connections, bounding sphere,
+# etc.)  Writes are committed immediately unless they happen inside a
+# batch():
+#
+#   with proj.metadb.batch():
+#       for image in proj.image_list:
+#           ...
+#           image.save_meta()
+#
+# in which case the whole batch is written with a single commit.
+
+import contextlib
+import json
+import os.path
+import sqlite3
+
+class MetaDB():
+    def __init__(self, project_dir):
+        self.db_file = project_dir + "/images.db"
+        self.conn = sqlite3.connect(self.db_file)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS image_meta "
+                          "(name TEXT PRIMARY KEY, meta TEXT NOT NULL)")
+        self.conn.commit()
+        self.batch_depth = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    # return the meta data dictionary of the named image (or None)
+    def get(self, name):
+        row = self.conn.execute("SELECT meta FROM image_meta WHERE name=?",
+                                (name,)).fetchone()
+        if row == None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, name, image_dict):
+        self.conn.execute("INSERT OR REPLACE INTO image_meta (name, meta) "
+                          "VALUES (?, ?)",
+                          (name, json.dumps(image_dict, sort_keys=True)))
+        if self.batch_depth == 0:
+            self.conn.commit()
+
+    def has(self, name):
+        row = self.conn.execute("SELECT 1 FROM image_meta WHERE name=?",
+                                (name,)).fetchone()
+        return row != None
+
+    def names(self):
+        return [ row[0] for row in
+                 self.conn.execute("SELECT name FROM image_meta ORDER BY name") ]
+
+    # group many writes into one transaction (batches may be nested,
+    # the commit happens when the outermost batch ends.)  If the batch
+    # is interrupted by an exception nothing from it is written.
+    @contextlib.contextmanager
+    def batch(self):
+        self.batch_depth += 1
+        try:
+            yield self
+        except:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self.conn.rollback()
+            raise
+        self.batch_depth -= 1
+        if self.batch_depth == 0:
+            self.conn.commit()
+
+    # one time import of the original .info files.  info_files is a
+    # list of (name, filename) pairs.  Images already in the database
+    # are skipped unless force is True.  Returns the number of images
+    # imported.
+    def import_info_files(self, info_files, force=False):
+        count = 0
+        with self.batch():
+            for name, filename in info_files:
+                if not os.path.exists(filename):
+                    continue
+                if not force and self.has(name):
+                    continue
+                try:
+                    f = open(filename, 'r')
+                    image_dict = json.load(f)
+                    f.close()
+                except:
+                    print filename + ": unable to import, skipping"
+                    continue
+                self.put(name, image_dict)
+                count += 1
+        return count
@@ -29,37 +29,38 @@ d2r = math.pi / 180.0
 # define the image aircraft poses from Sentera meta data file
 def setAircraftPoses(proj, metafile="", order='ypr', force=True, weight=True):
     f = fileinput.input(metafile)
-    for line in f:
-        line.strip()
-        if re.match('^\s*#', line):
-            print "skipping comment ", line
-            continue
-        if re.match('^\s*File', line):
-            print "skipping header ", line
-            continue
-        field = line.split(',')
-        name = field[0]
-        lat = float(field[1])
-        lon = float(field[2])
-        alt = float(field[3])
-        if order == 'ypr':
-            yaw = float(field[4])
-            pitch = float(field[5])
-            roll = float(field[6])
-        elif order == 'rpy':
-            roll = float(field[4])
-            pitch = float(field[5])
-            yaw = float(field[6])
+    with proj.metadb.batch():
+        for line in f:
+            line.strip()
+            if re.match('^\s*#', line):
+                print "skipping comment ", line
+                continue
+            if re.match('^\s*File', line):
+                print "skipping header ", line
+                continue
+            field = line.split(',')
+            name = field[0]
+            lat = float(field[1])
+            lon = float(field[2])
+            alt = float(field[3])
+            if order == 'ypr':
+                yaw = float(field[4])
+                pitch = float(field[5])
+                roll = float(field[6])
+            elif order == 'rpy':
+                roll = float(field[4])
+                pitch = float(field[5])
+                yaw = float(field[6])
 
-        image = proj.findImageByName(name)
-        if image != None:
-            if force or (math.fabs(image.aircraft_lon) < 0.01 and math.fabs(image.aircraft_lat) < 0.01):
-                image.set_aircraft_pose( [lat, lon,alt], [yaw, pitch, roll] )
-                image.weight = 1.0
-                image.save_meta()
-                print "%s yaw=%.1f pitch=%.1f roll=%.1f" % (image.name, yaw, pitch, roll)
-        else:
-            print "Error: image-metadata.txt references an image not in our data set =", name
+            image = proj.findImageByName(name)
+            if image != None:
+                if force or (math.fabs(image.aircraft_lon) < 0.01 and math.fabs(image.aircraft_lat) < 0.01):
+                    image.set_aircraft_pose( [lat, lon,alt], [yaw, pitch, roll] )
+                    image.weight = 1.0
+                    image.save_meta()
+                    print "%s yaw=%.1f pitch=%.1f roll=%.1f" % (image.name, yaw, pitch, roll)
+            else:
+                print "Error: image-metadata.txt references an image not in our data set =", name
 
                 
 # compute the camera pose in NED space, assuming the aircraft
@@ -1,12 +1,16 @@
 #!/usr/bin/python
 
+import collections
 import commands
 import cv2
 import fileinput
 import fnmatch
+import hashlib
 import json
 import math
 from matplotlib import pyplot as plt
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import os.path
 from progress.bar import Bar
@@ -19,15 +23,45 @@ import geojson
 
 from getchar import find_getch
 import Camera
+import DescriptorCache
+import FeatureArchive
 import Image
 
 import ImageList
+import ImagePipeline
 import Matcher
+import MetaDB
 import Placer
 import Render
 import transformations
 
 
+# Parallel feature detection workers.  Each worker process builds its
+# detector once (opencv detectors can't be pickled and sent along with
+# the work) and then reuses it for every image it is handed.
+worker_dparams = None
+worker_detector = None
+
+def detect_worker_init(dparams):
+    global worker_dparams
+    global worker_detector
+    # the workers already keep every core busy
+    cv2.setNumThreads(1)
+    worker_dparams = dparams
+    worker_detector = Image.make_detector(dparams)
+
+# each worker decodes its own images (only the file name is sent over,
+# never the pixels) so decoding scales with the number of workers
+def detect_worker(work):
+    (image_file, height, width, scale) = work
+    image = Image.Image()
+    image.image_file = image_file
+    image.height = height
+    image.width = width
+    gray = image.load_gray(scale)
+    return Image.detect(worker_detector, worker_dparams, gray)
+
+
 class ProjectMgr():
     def __init__(self, project_dir=None):
         # directories
@@ -38,8 +72,12 @@ class ProjectMgr():
         self.cam = Camera.Camera()
         
         self.image_list = []
+        self.archive = None      # project level keypoint/descriptor store
+        self.metadb = None       # project level image meta data store
+        self.des_cache = DescriptorCache.DescriptorCache()
 
         self.detector_params = { 'detector': 'SIFT', # { SIFT, SURF, ORB, Star }
+                                 'detect-scale': 1.0, # 1.0, 0.5, 0.25, 0.125
                                  'grid-detect': 1,
                                  'sift-max-features': 2000,
                                  'surf-hessian-threshold': 600,
@@ -221,36 +259,101 @@ class ProjectMgr():
                 file_list.append(file)
         file_list.sort()
 
+        # all image features are stored in (and loaded from) the
+        # project feature archive when possible
+        self.archive = FeatureArchive.FeatureArchive(self.project_dir)
+
+        # all image meta data is stored in the project meta data
+        # database (the original .info files are imported on first use)
+        if self.metadb == None:
+            self.metadb = MetaDB.MetaDB(self.project_dir)
+
         # wipe image list (so we don't double load)
         self.image_list = []
-        for file_name in file_list:
-            image = Image.Image(self.image_dir, file_name)
-            self.image_list.append( image )
-
-        # load rgb and determine image dimensions of this step has not
-        # already been done
-        bar = Bar('Computing image dimensions:', max = len(self.image_list))
+        with self.metadb.batch():
+            for file_name in file_list:
+                image = Image.Image(self.image_dir, file_name, self.metadb)
+                image.archive = self.archive
+                self.image_list.append( image )
+
+        # determine image dimensions if this step has not already been
+        # done.  Only the jpeg headers are read (across a pool of
+        # threads since this is almost entirely file i/o.)
+        todo = []
         for image in self.image_list:
             if force_compute_sizes or image.height == 0 or image.width == 0:
-                image.load_rgb(force_resize=True)
-                image.save_meta()
-            bar.next()
-        bar.finish()
+                todo.append(image)
+        if len(todo):
+            bar = Bar('Computing image dimensions:', max = len(todo))
+            pool = ThreadPool(min(16, 2 * multiprocessing.cpu_count()))
+            for result in pool.imap_unordered(lambda image: image.probe_size(),
+                                              todo):
+                bar.next()
+            pool.close()
+            pool.join()
+            bar.finish()
+            # sqlite connections don't cross threads, save from here
+            with self.metadb.batch():
+                for image in todo:
+                    image.save_meta()
             
         # make sure our matcher gets a copy of the image list
         #self.m.setImageList(self.image_list)
         self.placer.setImageList(self.image_list)
         self.render.setImageList(self.image_list)
 
-    def load_features(self):
-        bar = Bar('Loading keypoints and descriptors:',
-                  max = len(self.image_list))
+    # descriptors=False skips loading descriptors up front (they can be
+    # loaded on demand through self.des_cache)
+    def load_features(self, descriptors=True):
+        if descriptors:
+            title = 'Loading keypoints and descriptors:'
+        else:
+            title = 'Loading keypoints:'
+        bar = Bar(title, max = len(self.image_list))
         for image in self.image_list:
             image.load_features()
-            image.load_descriptors()
+            if descriptors:
+                image.load_descriptors()
             bar.next()
         bar.finish()
 
+    # convert any original format (pickle/json) feature files in the
+    # project to the binary keypoint format
+    def upgrade_features(self, remove_legacy=False):
+        count = 0
+        errors = 0
+        bar = Bar('Upgrading feature files:', max = len(self.image_list))
+        for image in self.image_list:
+            result = image.upgrade_features(remove_legacy)
+            if result > 0:
+                count += 1
+            elif result < 0:
+                errors += 1
+            bar.next()
+        bar.finish()
+        return count, errors
+
+    # copy any features still stored in per image files into the
+    # project feature archive
+    def archive_features(self, compact=False):
+        count = 0
+        bar = Bar('Archiving feature files:', max = len(self.image_list))
+        for image in self.image_list:
+            if not self.archive.has(image.name, 'kp'):
+                image.archive = None
+                image.load_features()
+                image.load_descriptors()
+                image.archive = self.archive
+                if len(image.kp_list):
+                    image.save_features()
+                    image.save_descriptors()
+                    count += 1
+            bar.next()
+        bar.finish()
+        if compact:
+            self.archive.compact()
+        return count
+
     def load_match_pairs(self):
         print ""
         print "ProjectMgr.load_match_pairs():"
@@ -295,8 +398,23 @@ class ProjectMgr():
         return result
                 
     def save_images_meta(self):
+        with self.metadb.batch():
+            for image in self.image_list:
+                image.save_meta()
+
+    # one time import of the original per image .info files into the
+    # project meta data database (force replaces existing records.)
+    def import_image_meta(self, force=False):
+        info_files = []
         for image in self.image_list:
-            image.save_meta()
+            info_files.append( (image.name, image.info_file) )
+        count = self.metadb.import_info_files(info_files, force=force)
+        if force:
+            # reload so the in memory images match the database
+            with self.metadb.batch():
+                for image in self.image_list:
+                    image.load_meta()
+        return count
 
     def set_detector_params(self, dparams):
         self.detector_params = dparams
@@ -304,25 +422,119 @@ class ProjectMgr():
     def set_matcher_params(self, mparams):
         self.matcher_params = mparams
         
-    def detect_features(self, force=True, show=False):
+    # canonical fingerprint of the detector parameters (values are
+    # compared as strings since they may come from the command line)
+    def detector_params_hash(self):
+        canon = {}
+        for key in self.detector_params:
+            canon[key] = str(self.detector_params[key])
+        return hashlib.sha1(json.dumps(canon, sort_keys=True)).hexdigest()
+
+    # true if the image has saved features that were detected from the
+    # current image contents with the current detector parameters
+    def features_current(self, image, image_hash, params_hash):
+        if not image.has_features():
+            return False
+        sig = image.detect_signature
+        return sig.get('image-hash') == image_hash \
+            and sig.get('params-hash') == params_hash
+
+    # Features are only (re)detected for images that changed or were
+    # detected with different parameters, unless force is set.
+    #
+    # jobs > 1 runs decoding and detection across that many worker
+    # processes (not when showing the features as we go.)  Otherwise
+    # images are decoded ahead of time by 'readers' threads (holding at
+    # most queue_depth decoded images) so file i/o and decoding overlap
+    # with detection.
+    def detect_features(self, force=True, show=False, jobs=1, readers=2,
+                        queue_depth=4):
+        params_hash = self.detector_params_hash()
+        todo = []
+        hashes = []
+        for image in self.image_list:
+            if force or not image.has_features():
+                # nothing to compare against, hashed when saved
+                todo.append(image)
+                hashes.append(None)
+                continue
+            image_hash = image.content_hash()
+            if not self.features_current(image, image_hash, params_hash):
+                todo.append(image)
+                hashes.append(image_hash)
         if not show:
             bar = Bar('Detecting features:', max = len(self.image_list))
-        for image in self.image_list:
-            if force or len(image.kp_list) == 0 or image.des_list == None:
-                #print "detecting features and computing descriptors: " + image.name
-                gray = image.load_gray()
-                image.detect_features(self.detector_params, gray)
-                image.save_features()
-                image.save_descriptors()
-                image.save_matches()
-                if show:
-                    result = image.show_features()
-                    if result == 27 or result == ord('q'):
-                        break
-            if not show:
+            for i in range(len(self.image_list) - len(todo)):
                 bar.next()
+        # detectors configured for a reduced scale get reduced
+        # resolution decodes
+        scale = float(self.detector_params.get('detect-scale', 1.0))
+        pipeline = None
+        # one commit for all the detect signatures
+        with self.metadb.batch():
+            if jobs > 1 and not show:
+                self.detect_features_parallel(todo, hashes, params_hash, scale,
+                                              jobs, bar)
+            else:
+                pipeline = ImagePipeline.ImagePipeline(todo, readers,
+                                                       queue_depth, scale)
+                detector = Image.make_detector(self.detector_params)
+                for i, (image, gray) in enumerate(pipeline):
+                    #print "detecting features and computing descriptors: " + image.name
+                    image.detect_features(self.detector_params, gray, detector)
+                    self.save_detected_features(image, hashes[i], params_hash)
+                    if show:
+                        # reuse the decoded image rather than loading it again
+                        result = image.show_features(gray=gray)
+                        if result == 27 or result == ord('q'):
+                            pipeline.stop()
+                            break
+                    else:
+                        bar.next()
         if not show:
             bar.finish()
+        if pipeline and len(todo):
+            pipeline.report()
+
+    # images are detected by a pool of worker processes, the results
+    # come back in the original image order and are saved from here
+    # (so all the project file writes stay in this process.)  Only
+    # enough images to keep the workers busy are handed out at a time so
+    # at most 2 x jobs decoded images and results are held at once.
+    def detect_features_parallel(self, todo, hashes, params_hash, scale,
+                                 jobs, bar):
+        pool = multiprocessing.Pool(jobs, detect_worker_init,
+                                    (self.detector_params,))
+        pending = collections.deque()
+        for i, image in enumerate(todo):
+            work = (image.image_file, image.height, image.width, scale)
+            pending.append( (image, hashes[i],
+                             pool.apply_async(detect_worker, (work,))) )
+            while len(pending) >= 2 * jobs:
+                self.finish_detect(pending.popleft(), params_hash)
+                bar.next()
+        while len(pending):
+            self.finish_detect(pending.popleft(), params_hash)
+            bar.next()
+        pool.close()
+        pool.join()
+
+    def finish_detect(self, job, params_hash):
+        (image, image_hash, result) = job
+        kp_array, des_list = result.get()
+        image.set_features(kp_array, des_list)
+        self.save_detected_features(image, image_hash, params_hash)
+
+    def save_detected_features(self, image, image_hash, params_hash):
+        if image_hash == None:
+            # the file was just read for detection so this is mostly
+            # served from the os cache
+            image_hash = image.content_hash()
+        image.save_features()
+        image.save_descriptors()
+        image.save_matches()
+        image.set_detect_signature(image_hash, params_hash)
+        image.save_meta()
 
     def show_features_image(self, image):
         result = image.show_features()
@@ -394,16 +606,11 @@ class ProjectMgr():
                 continue
             scale = float(image.width) / float(camw)
             K = self.cam.get_K(scale)
-            uv_raw = np.zeros((len(image.kp_list),1,2), dtype=np.float32)
-            for i, kp in enumerate(image.kp_list):
-                uv_raw[i][0] = (kp.pt[0], kp.pt[1])
+            uv_raw = image.kp_list.pts.reshape(-1,1,2)
             dist_coeffs = np.array(self.cam.camera_dict['dist-coeffs'],
                                    dtype=np.float32)
             uv_new = cv2.undistortPoints(uv_raw, K, dist_coeffs, P=K)
-            image.uv_list = []
-            for i, uv in enumerate(uv_new):
-                image.uv_list.append(uv_new[i][0])
-                #print "  orig = %s  undistort = %s" % (uv_raw[i][0], uv_new[i][0])
+            image.uv_list = list(uv_new.reshape(-1,2))
             bar.next()
         bar.finish()
                 
@@ -464,36 +671,32 @@ class ProjectMgr():
                 image = self.image_list[ p[0] ]
                 image.kp_used[ p[1] ] = True
                     
-    # project the list of (u, v) pixels from image space into camera
-    # space, remap that to a vector in ned space (for camera
-    # ypr=[0,0,0], and then transform that by the camera pose, returns
-    # the vector from the camera, through the pixel, into ned space
+    # project the (u, v) pixels from image space into camera space,
+    # remap that to a vector in ned space (for camera ypr=[0,0,0]), and
+    # then transform that by the camera pose.  Returns the unit vectors
+    # from the camera, through the pixels, into ned space as an Nx3
+    # array.  uv_list may be a list of (u, v) pairs or an Nx2 array.
+    # The camera to ned transform is combined into a single 3x3 matrix
+    # once and applied to all the points together.
+    def projectVectorsArray(self, IK, body2ned, cam2body, uv_list):
+        uv = np.asarray(uv_list, dtype=np.float64).reshape(-1, 2)
+        # (body2ned, cam2body, or IK may be np.matrix)
+        M = np.asarray(body2ned).dot(np.asarray(cam2body)).dot(np.asarray(IK))
+        uvh = np.hstack( (uv, np.ones( (len(uv), 1) )) )
+        proj = uvh.dot(M.T)
+        norm = np.sqrt(np.sum(proj * proj, axis=1))
+        return proj / norm[:,np.newaxis]
+
+    # same as projectVectorsArray() but returns a list of vectors
     def projectVectors(self, IK, body2ned, cam2body, uv_list):
-        proj_list = []
-        for uv in uv_list:
-            uvh = np.array([uv[0], uv[1], 1.0])
-            proj = body2ned.dot(cam2body).dot(IK).dot(uvh)
-            proj_norm = transformations.unit_vector(proj)
-            proj_list.append(proj_norm)
-
-        #for uv in uv_list:
-        #    print "uv:", uv
-        #    uvh = np.array([uv[0], uv[1], 1.0])
-        #    print "cam vec=", transformations.unit_vector(IR.dot(IK).dot(uvh))
-        return proj_list
+        return list(self.projectVectorsArray(IK, body2ned, cam2body, uv_list))
 
     # project the (u, v) pixels for the specified image using the current
     # sba pose and write them to image.vec_list
     def projectVectorsImageSBA(self, IK, image):
-        vec_list = []
-        body2ned = image.get_body2ned_sba()
-        cam2body = image.get_cam2body()
-        for uv in image.uv_list:
-            uvh = np.array([uv[0], uv[1], 1.0])
-            proj = body2ned.dot(cam2body).dot(IK).dot(uvh)
-            proj_norm = transformations.unit_vector(proj)
-            vec_list.append(proj_norm)
-        return vec_list
+        return list(self.projectVectorsArray(IK, image.get_body2ned_sba(),
+                                             image.get_cam2body(),
+                                             image.uv_list))
 
     # given a set of vectors in the ned frame, and a starting point.
     # Find the ground intersection point.  For any vectors which point into
@@ -750,62 +953,65 @@ class ProjectMgr():
                                      force=False, weight=True):
         # tag each image with the flight data parameters at the time
         # the image was taken
-        for match in correlator.best_matchups:
-            pict, trig = correlator.get_match(match)
-            image = self.findImageByName(pict[2])
-            if image != None:
-                aircraft_lon = 0.0
-                aircraft_lat = 0.0
-                if image.aircraft_pose:
-                    aircraft_lat = image.aircraft_pose['lla'][0]
-                    aircraft_lon = image.aircraft_pose['lla'][1]
-                if force or (math.fabs(aircraft_lon) < 0.01 and math.fabs(aircraft_lat) < 0.01):
-                    # only if we are forcing a new position
-                    # calculation or the position is not already set
-                    # from a save file.
-                    t = trig[0] + shutter_latency
-                    lon, lat, msl = correlator.get_position(t)
-                    roll, pitch, yaw = correlator.get_attitude(t)
-                    image.set_aircraft_pose( [lat, lon, msl],
-                                             [yaw, pitch, roll] )
-                    if weight:
-                        # presumes a pitch/roll distance of 10, 10 gives a
-                        # zero weight
-                        w = 1.0 - (roll*roll + pitch*pitch)/200.0
-                        if w < 0.01:
-                            w = 0.01
-                        image.weight = w
-                    else:
-                        image.weight = 1.0
-                    image.save_meta()
-                    #print "%s roll=%.1f pitch=%.1f weight=%.2f" % (image.name, roll, pitch, image.weight)
+        with self.metadb.batch():
+            for match in correlator.best_matchups:
+                pict, trig = correlator.get_match(match)
+                image = self.findImageByName(pict[2])
+                if image != None:
+                    aircraft_lon = 0.0
+                    aircraft_lat = 0.0
+                    if image.aircraft_pose:
+                        aircraft_lat = image.aircraft_pose['lla'][0]
+                        aircraft_lon = image.aircraft_pose['lla'][1]
+                    if force or (math.fabs(aircraft_lon) < 0.01 and math.fabs(aircraft_lat) < 0.01):
+                        # only if we are forcing a new position
+                        # calculation or the position is not already set
+                        # from a save file.
+                        t = trig[0] + shutter_latency
+                        lon, lat, msl = correlator.get_position(t)
+                        roll, pitch, yaw = correlator.get_attitude(t)
+                        image.set_aircraft_pose( [lat, lon, msl],
+                                                 [yaw, pitch, roll] )
+                        if weight:
+                            # presumes a pitch/roll distance of 10, 10 gives a
+                            # zero weight
+                            w = 1.0 - (roll*roll + pitch*pitch)/200.0
+                            if w < 0.01:
+                                w = 0.01
+                            image.weight = w
+                        else:
+                            image.weight = 1.0
+                        image.save_meta()
+                        #print "%s roll=%.1f pitch=%.1f weight=%.2f" % (image.name, roll, pitch, image.weight)
 
     def computeWeights(self, force=None):
         # tag each image with the flight data parameters at the time
         # the image was taken
-        for image in self.image_list:
-            roll = image.aircraft_roll + image.roll_bias
-            pitch = image.aircraft_pitch + image.pitch_bias
-            if force != None:
-                image.weight = force
-            else:
-                # presumes a pitch/roll distance of 10, 10 gives a
-                # zero weight
-                w = 1.0 - (roll*roll + pitch*pitch)/200.0
-                if w < 0.01:
-                    w = 0.01
-                    image.weight = w
-            image.save_meta()
-            #print "%s roll=%.1f pitch=%.1f weight=%.2f" % (image.name, roll, pitch, image.weight)
+        with self.metadb.batch():
+            for image in self.image_list:
+                roll = image.aircraft_roll + image.roll_bias
+                pitch = image.aircraft_pitch + image.pitch_bias
+                if force != None:
+                    image.weight = force
+                else:
+                    # presumes a pitch/roll distance of 10, 10 gives a
+                    # zero weight
+                    w = 1.0 - (roll*roll + pitch*pitch)/200.0
+                    if w < 0.01:
+                        w = 0.01
+                        image.weight = w
+                image.save_meta()
+                #print "%s roll=%.1f pitch=%.1f weight=%.2f" % (image.name, roll, pitch, image.weight)
 
     def computeConnections(self, force=None):
-        for image in self.image_list:
-            image.connections = 0
-            for pairs in image.match_list:
-                if len(pairs) >= self.m.min_pairs:
-                    image.connections += 1
-            image.save_meta()
-            print "%s connections: %d" % (image.name, image.connections)
+        with self.metadb.batch():
+            for image in self.image_list:
+                image.connections = 0
+                for pairs in image.match_list:
+                    if len(pairs) >= self.m.min_pairs:
+                        image.connections += 1
+                image.save_meta()
+                print "%s connections: %d" % (image.name, image.connections)
 
 
     # depricate this function .... or replace with better one (or just
@@ -1109,14 +1315,15 @@ class ProjectMgr():
 
     # zero all biases (if we want to start over with a from scratch fit)
     def zeroImageBiases(self):
-        for image in self.image_list:
-            image.yaw_bias = 0.0
-            image.roll_bias = 0.0
-            image.pitch_bias = 0.0
-            image.alt_bias = 0.0
-            image.x_bias = 0.0
-            image.y_bias = 0.0
-            image.save_meta()
+        with self.metadb.batch():
+            for image in self.image_list:
+                image.yaw_bias = 0.0
+                image.roll_bias = 0.0
+                image.pitch_bias = 0.0
+                image.alt_bias = 0.0
+                image.x_bias = 0.0
+                image.y_bias = 0.0
+                image.save_meta()
 
     # try to fit individual images by manipulating various parameters
     # and testing to see if that produces a better fit metric
@@ -30,8 +30,12 @@ class Render():
         result = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
         return result
  
+    # scale < 1.0 renders from a reduced resolution decode of the source
+    # image (much faster when the output resolution is lower than the
+    # source, 0.5, 0.25, and 0.125 are decoded directly at that size.)
     def drawImage(self, image, K, dist_coeffs, source_dir=None,
-                  cm_per_pixel=15.0, keypoints=False, bounds=None):
+                  cm_per_pixel=15.0, keypoints=False, bounds=None,
+                  scale=1.0):
         if not len(image.corner_list_xy):
             return
         if bounds == None:
@@ -43,8 +47,12 @@ class Render():
         #print "Drawing %s: (%d %d)" % (image.name, x, y)
         #print str(image.corner_list_xy)
 
-        full_image = image.load_source_rgb(source_dir)
+        full_image = image.load_source_rgb(source_dir, scale)
         h, w, d = full_image.shape
+        if scale != 1.0:
+            # camera matrix in reduced image pixels
+            K = np.array(K, dtype=float)
+            K[0:2,:] *= scale
         equalized = self.aeq_value(full_image)
         
         corners = np.array([[0,0],[w,0],[0,h],[w,h]], dtype=np.float32)
@@ -55,10 +63,8 @@ class Render():
             target[0][i][1] = 100.0 * (ymax - target[0][i][1]) / cm_per_pixel
         #print str(target)
         if keypoints:
-            keypoints = []
-            for i, kp in enumerate(image.kp_list):
-                if image.kp_usage[i]:
-                    keypoints.append(kp)
+            keypoints = image.kp_list.to_cv2(np.nonzero(image.kp_usage)[0],
+                                             scale=scale)
             src = cv2.drawKeypoints(equalized, keypoints,
                                     color=(0,255,0), flags=0)
         else:
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+# SpatialIndex.py - a kd-tree (scipy cKDTree) over an image's point
+# list (i.e. the ned coord_list of its keypoints) that is built once
+# and then shared by every neighbor image that queries it.
+#
+# Points that aren't finite (keypoints that didn't project onto the
+# ground) are left out of the tree, but all results are reported as
+# indices into the original point list.  As with scipy, a query that
+# finds fewer than k neighbors reports the missing ones with an
+# infinite distance and an index equal to the number of points.
+#
+# The tree can be pickled to a file (cKDTree keeps its node arrays
+# when pickled) along with a checksum of the points it was built from,
+# so a later stage can load it instead of rebuilding it.
+
+import cPickle as pickle
+import numpy as np
+import os
+import scipy.spatial
+import zlib
+
+# checksum of a point list (to tell whether a tree is still current)
+def points_crc(points):
+    a = np.ascontiguousarray(points, dtype=np.float64)
+    return zlib.crc32(a.tostring()) & 0xffffffff
+
+class SpatialIndex():
+    # balanced_tree/compact_nodes are passed to cKDTree, turning them
+    # off builds a lot faster at a small cost in query time
+    def __init__(self, points, balanced_tree=False, compact_nodes=False):
+        points = np.asarray(points, dtype=np.float64)
+        self.count = len(points)
+        self.crc = points_crc(points)
+        if self.count:
+            finite = np.all(np.isfinite(points.reshape(self.count, -1)),
+                            axis=1)
+            self.rows = np.nonzero(finite)[0]
+            tree_points = points[self.rows]
+        else:
+            self.rows = np.zeros(0, dtype=int)
+            tree_points = np.zeros( (0, 3) )
+        # map tree indices (plus the 'missing' index) back to the
+        # original rows
+        self.row_map = np.append(self.rows, self.count)
+        if len(self.rows):
+            self.tree = scipy.spatial.cKDTree(tree_points,
+                                              balanced_tree=balanced_tree,
+                                              compact_nodes=compact_nodes)
+        else:
+            self.tree = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    # indices of the points within r of x.  x may be a single point
+    # (returns a sorted list) or an array of points (returns an array
+    # of sorted lists, one per point.)
+    def query_ball_point(self, x, r):
+        x = np.asarray(x, dtype=np.float64)
+        if x.ndim == 1:
+            if self.tree == None:
+                return []
+            result = self.tree.query_ball_point(x, r)
+            return sorted(self.rows[result].tolist())
+        result = np.empty(len(x), dtype=object)
+        for i in range(len(x)):
+            result[i] = []
+        if self.tree != None and len(x):
+            for i, found in enumerate(self.tree.query_ball_point(x, r)):
+                result[i] = sorted(self.rows[found].tolist())
+        return result
+
+    # the k nearest points to x (a single point or an array of
+    # points.)  Returns (dist, index) shaped like cKDTree.query()
+    def query(self, x, k=1, distance_upper_bound=np.inf):
+        if self.tree == None:
+            x = np.asarray(x, dtype=np.float64)
+            shape = x.shape[:-1]
+            if k > 1:
+                shape = shape + (k,)
+            return np.full(shape, np.inf), np.full(shape, self.count, dtype=int)
+        (dist, index) = self.tree.query(x, k=k,
+                                        distance_upper_bound=distance_upper_bound)
+        return dist, self.row_map[index]
+
+    # true if the index was built from these points
+    def current(self, points):
+        return len(points) == self.count and points_crc(points) == self.crc
+
+    def save(self, filename):
+        try:
+            tmp = filename + ".%d.tmp" % os.getpid()
+            f = open(tmp, 'wb')
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+            f.close()
+            os.rename(tmp, filename)
+        except:
+            print filename + ": unable to save spatial index"
+
+# load a saved index, returns None if it is missing, unreadable, or
+# was built from different points
+def load(filename, points=None):
+    if not os.path.exists(filename):
+        return None
+    try:
+        f = open(filename, 'rb')
+        index = pickle.load(f)
+        f.close()
+    except:
+        print filename + ": unable to load spatial index"
+        return None
+    if points is not None and not index.current(points):
+        return None
+    return index
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+# TrackTable.py - compact array storage for the matches_direct,
+# matches_sba, and matches_group feature track lists.
+#
+# The original format is a python list with one entry per 3d feature:
+#
+#   [ ned, [image_index, keypoint_index], [image_index, keypoint_index], ... ]
+#
+# which is slow to (un)pickle and very memory hungry once there are a
+# few million observations.  A TrackTable holds the same information in
+# 4 flat arrays (compressed sparse row layout):
+#
+#   points:   Mx3 float64 feature locations (NaN if not placed / None)
+#   offsets:  M+1 int64, observations of track i live in [offsets[i], offsets[i+1])
+#   images:   N int32 image index of each observation
+#   features: N int32 keypoint index of each observation
+#   placed:   M bool, False where the original ned was None (so a
+#             location that really is NaN round trips as NaN, not None)
+#
+# It saves to a single .npz file (or a directory of .npy files which
+# can be memory mapped), and to_list() / iteration provide the original
+# list format while scripts are migrated.
+
+import cPickle as pickle
+import numpy as np
+import os.path
+
+class TrackTable():
+    def __init__(self, points=None, offsets=None, images=None, features=None,
+                 placed=None):
+        if points is None:
+            points = np.zeros( (0, 3), dtype=np.float64 )
+        if offsets is None:
+            offsets = np.zeros( 1, dtype=np.int64 )
+        if images is None:
+            images = np.zeros( 0, dtype=np.int32 )
+        if features is None:
+            features = np.zeros( 0, dtype=np.int32 )
+        self.points = points
+        self.offsets = offsets
+        self.images = images
+        if placed is None:
+            # tables saved before 'placed' existed: all NaN means None
+            placed = np.logical_not(np.isnan(points).all(axis=1))
+        self.features = features
+        self.placed = placed
+
+    # build a track table from the original list format
+    @classmethod
+    def from_list(cls, matches):
+        count = len(matches)
+        points = np.empty( (count, 3), dtype=np.float64 )
+        offsets = np.empty( count + 1, dtype=np.int64 )
+        placed = np.ones( count, dtype=bool )
+        offsets[0] = 0
+        total = 0
+        for i, match in enumerate(matches):
+            if match[0] is None:
+                points[i] = np.nan
+                placed[i] = False
+            else:
+                points[i] = np.asarray(match[0], dtype=np.float64).reshape(-1)[:3]
+            total += len(match) - 1
+            offsets[i+1] = total
+        obs = np.empty( (total, 2), dtype=np.int32 )
+        k = 0
+        for match in matches:
+            for m in match[1:]:
+                obs[k] = (m[0], m[1])
+                k += 1
+        return cls(points, offsets, np.ascontiguousarray(obs[:,0]),
+                   np.ascontiguousarray(obs[:,1]), placed)
+
+    def __len__(self):
+        return len(self.points)
+
+    # number of observations of each track
+    def track_lengths(self):
+        return np.diff(self.offsets)
+
+    # (image_index, keypoint_index) arrays of the observations of track i
+    def observations(self, i):
+        start = self.offsets[i]
+        end = self.offsets[i+1]
+        return self.images[start:end], self.features[start:end]
+
+    # the original list format entry for track i
+    def __getitem__(self, i):
+        start = self.offsets[i]
+        end = self.offsets[i+1]
+        if self.placed[i]:
+            ned = self.points[i].tolist()
+        else:
+            ned = None
+        match = [ ned ]
+        for img, feat in zip(self.images[start:end].tolist(),
+                             self.features[start:end].tolist()):
+            match.append( [img, feat] )
+        return match
+
+    def __iter__(self):
+        for i in range(len(self.points)):
+            yield self[i]
+
+    # compatibility view: the full original (mutable) list format
+    def to_list(self):
+        return [ match for match in self ]
+
+    # save as a single .npz file, or (if filename doesn't end in .npz)
+    # as a directory of .npy files that load() can memory map
+    def save(self, filename):
+        if filename.endswith(".npz"):
+            # write to a temp file and rename so an interrupted save
+            # never leaves a truncated table behind
+            tmp = filename[:-4] + ".tmp.npz"
+            np.savez(tmp, points=self.points, offsets=self.offsets,
+                     images=self.images, features=self.features,
+                     placed=self.placed)
+            os.rename(tmp, filename)
+        else:
+            if not os.path.isdir(filename):
+                os.makedirs(filename)
+            np.save(os.path.join(filename, "points.npy"), self.points)
+            np.save(os.path.join(filename, "offsets.npy"), self.offsets)
+            np.save(os.path.join(filename, "images.npy"), self.images)
+            np.save(os.path.join(filename, "features.npy"), self.features)
+            np.save(os.path.join(filename, "placed.npy"), self.placed)
+
+    @classmethod
+    def load(cls, filename, mmap_mode=None):
+        if filename.endswith(".npz"):
+            data = np.load(filename)
+            placed = None
+            if 'placed' in data.files:
+                placed = data['placed']
+            return cls(data['points'], data['offsets'], data['images'],
+                       data['features'], placed)
+        else:
+            arrays = []
+            for name in [ "points", "offsets", "images", "features" ]:
+                arrays.append( np.load(os.path.join(filename, name + ".npy"),
+                                       mmap_mode=mmap_mode) )
+            placed_file = os.path.join(filename, "placed.npy")
+            if os.path.exists(placed_file):
+                arrays.append( np.load(placed_file, mmap_mode=mmap_mode) )
+            return cls(*arrays)
+
+# Load a match file (i.e. project_dir + "/matches_direct") and return
+# it in the original list format.  The track table version (.npz) is
+# preferred if it exists, otherwise the original pickle is read.
+def load_matches(basename):
+    if os.path.exists(basename + ".npz"):
+        return TrackTable.load(basename + ".npz").to_list()
+    return pickle.load( open( basename, "rb" ) )
+
+# Save a list format match structure as a track table (.npz).  The
+# original pickle (if any) is left alone, but load_matches() will
+# prefer the new file from now on.
+def save_matches(matches, basename):
+    if isinstance(matches, TrackTable):
+        table = matches
+    else:
+        table = TrackTable.from_list(matches)
+    table.save(basename + ".npz")
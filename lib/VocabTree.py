@@ -0,0 +1,216 @@
+#!/usr/bin/python
+
+# VocabTree.py - bag of visual words image retrieval (a vocabulary
+# tree) to find the images that look alike, independent of their
+# estimated poses.
+#
+# Candidate pairs normally come from the projected bounding spheres
+# (see CandidatePairs.py) which are only as good as the camera poses.
+# With poor IMU data real overlaps get pruned and false ones matched.
+# Here the descriptors of each image are quantized into visual words
+# with a hierarchical k-means tree (branch^depth words), each image
+# becomes a tf-idf weighted word histogram, and the images with the
+# most similar histograms (cosine similarity) are returned as pairs.
+#
+#   vocab = VocabTree.train_from_images(image_list, des_cache)
+#   vocab.save(project_dir + "/vocab.npz")
+#   pairs = VocabTree.similar_pairs(image_list, vocab, k=10,
+#                                   des_cache=des_cache)
+#
+# Quantizing descends all descriptors one tree level at a time with
+# array operations and scoring is a sparse matrix product, so this
+# scales to many thousands of images.  Binary descriptors (ORB) are
+# clustered as if they were real valued vectors, which is a common
+# and adequate approximation for retrieval.
+
+import numpy as np
+import os
+import random
+import scipy.sparse
+import time
+
+# plain k-means (Lloyd's algorithm) with k-means++ seeding.  Returns
+# the (k, dim) centroids.  If there are fewer points than clusters the
+# missing centroids repeat the first point.
+def kmeans(data, k, iterations=10):
+    n = len(data)
+    if n == 0:
+        return np.zeros( (k, data.shape[1]), dtype=np.float32 )
+    if n <= k:
+        centroids = np.empty( (k, data.shape[1]), dtype=np.float32 )
+        centroids[:n] = data
+        centroids[n:] = data[0]
+        return centroids
+    # k-means++ seeding
+    centroids = [ data[random.randrange(n)] ]
+    d2 = np.sum((data - centroids[0])**2, axis=1)
+    for i in range(1, k):
+        total = np.sum(d2)
+        if total <= 0.0:
+            centroids.append(data[random.randrange(n)])
+        else:
+            pick = np.searchsorted(np.cumsum(d2), random.random() * total)
+            centroids.append(data[min(pick, n-1)])
+        d2 = np.minimum(d2, np.sum((data - centroids[-1])**2, axis=1))
+    centroids = np.array(centroids, dtype=np.float32)
+    for it in range(iterations):
+        labels = nearest(data, centroids)
+        for c in range(k):
+            members = data[labels == c]
+            if len(members):
+                centroids[c] = np.mean(members, axis=0)
+    return centroids
+
+# index of the nearest centroid for each row of data
+def nearest(data, centroids):
+    # |a-b|^2 = |a|^2 - 2ab + |b|^2 (|a|^2 doesn't change the argmin)
+    d = -2.0 * np.dot(data, centroids.T) + np.sum(centroids**2, axis=1)
+    return np.argmin(d, axis=1)
+
+class VocabTree():
+    def __init__(self, branch=10, depth=4):
+        self.branch = branch
+        self.depth = depth
+        # per level: (nodes, branch, dim) array of child centroids
+        self.levels = []
+        self.idf = None         # per word inverse document frequency
+
+    def words(self):
+        return self.branch ** self.depth
+
+    # hierarchical k-means over a sample of descriptors (N, dim)
+    def train(self, des):
+        des = np.asarray(des, dtype=np.float32)
+        self.levels = []
+        node = np.zeros(len(des), dtype=int)
+        for level in range(self.depth):
+            nodes = self.branch ** level
+            centroids = np.zeros( (nodes, self.branch, des.shape[1]),
+                                  dtype=np.float32 )
+            child = np.zeros(len(des), dtype=int)
+            for n in range(nodes):
+                members = np.nonzero(node == n)[0]
+                if len(members) == 0:
+                    # empty branch, unreachable in practice
+                    continue
+                centroids[n] = kmeans(des[members], self.branch)
+                child[members] = nearest(des[members], centroids[n])
+            self.levels.append(centroids)
+            node = node * self.branch + child
+
+    # visual word id of each descriptor
+    def quantize(self, des):
+        des = np.asarray(des, dtype=np.float32)
+        node = np.zeros(len(des), dtype=int)
+        for centroids in self.levels:
+            c = centroids[node]             # (N, branch, dim)
+            d = np.sum((c - des[:,np.newaxis,:])**2, axis=2)
+            node = node * self.branch + np.argmin(d, axis=1)
+        return node
+
+    def save(self, filename):
+        arrays = { 'branch': self.branch, 'depth': self.depth }
+        for level, centroids in enumerate(self.levels):
+            arrays['level%d' % level] = centroids
+        np.savez(filename, **arrays)
+
+# load a saved vocabulary (or None)
+def load(filename):
+    if not os.path.exists(filename):
+        return None
+    try:
+        data = np.load(filename)
+        vocab = VocabTree(int(data['branch']), int(data['depth']))
+        vocab.levels = [ data['level%d' % level]
+                         for level in range(vocab.depth) ]
+    except:
+        print filename + ": unable to load vocabulary"
+        return None
+    return vocab
+
+# return the descriptors of the image (through the descriptor cache if
+# one is given, otherwise loaded and dropped again after use)
+def image_descriptors(image, des_cache=None):
+    if des_cache:
+        return np.asarray(des_cache.get(image))
+    loaded = len(image.des_list) == 0
+    image.load_descriptors()
+    des = np.asarray(image.des_list)
+    if loaded:
+        image.des_list = []
+    return des
+
+# train a vocabulary from a random sample of the descriptors of up to
+# sample_images images (at most per_image descriptors from each)
+def train_from_images(image_list, des_cache=None, branch=10, depth=4,
+                      sample_images=500, per_image=500):
+    t0 = time.time()
+    images = list(image_list)
+    random.shuffle(images)
+    sample = []
+    for image in images[:sample_images]:
+        des = image_descriptors(image, des_cache)
+        if len(des) > per_image:
+            des = des[random.sample(range(len(des)), per_image)]
+        if len(des):
+            sample.append(np.asarray(des, dtype=np.float32))
+    vocab = VocabTree(branch, depth)
+    if len(sample):
+        vocab.train(np.concatenate(sample))
+    print "Trained a %d word vocabulary from %d descriptors in %.1f sec" \
+        % (vocab.words(), sum([len(s) for s in sample]), time.time() - t0)
+    return vocab
+
+# (images, words) matrix of l2 normalized tf-idf word histograms
+def bow_matrix(image_list, vocab, des_cache=None):
+    rows = []
+    cols = []
+    for i, image in enumerate(image_list):
+        des = image_descriptors(image, des_cache)
+        if len(des) == 0:
+            continue
+        words = np.unique(vocab.quantize(des), return_counts=True)
+        rows.append(np.full(len(words[0]), i, dtype=int))
+        cols.append( (words[0], words[1]) )
+    n = len(image_list)
+    if len(rows) == 0:
+        return scipy.sparse.csr_matrix( (n, vocab.words()) )
+    row = np.concatenate(rows)
+    col = np.concatenate([ c[0] for c in cols ])
+    tf = np.concatenate([ c[1] for c in cols ]).astype(np.float64)
+    m = scipy.sparse.csr_matrix( (tf, (row, col)), shape=(n, vocab.words()) )
+    # inverse document frequency: words seen in many images say little
+    df = np.bincount(col, minlength=vocab.words()).astype(np.float64)
+    idf = np.zeros(vocab.words())
+    seen = df > 0
+    idf[seen] = np.log(float(n) / df[seen])
+    vocab.idf = idf
+    m = m.dot(scipy.sparse.diags(idf))
+    norm = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+    norm[norm == 0.0] = 1.0
+    return scipy.sparse.diags(1.0 / norm).dot(m).tocsr()
+
+# the k most similar images of each image, as sorted (i, j) pairs
+# (i < j).  Scores are computed in blocks of rows to bound memory.
+def similar_pairs(image_list, vocab, k=10, des_cache=None, block=256):
+    t0 = time.time()
+    m = bow_matrix(image_list, vocab, des_cache)
+    t1 = time.time()
+    n = len(image_list)
+    k = min(k, n - 1)
+    pairs = set()
+    if k <= 0:
+        return []
+    mt = m.T.tocsc()
+    for start in range(0, n, block):
+        scores = m[start:start+block].dot(mt).toarray()
+        for r in range(len(scores)):
+            i = start + r
+            scores[r, i] = -1.0     # not itself
+            top = np.argpartition(-scores[r], k-1)[:k]
+            for j in top:
+                if scores[r, j] > 0.0:
+                    pairs.add( (min(i, j), max(i, j)) )
+    print "Retrieval: %d pairs from the top %d of %d images (%.1f sec quantize, %.1f sec score)" \
+        % (len(pairs), k, n, t1 - t0, time.time() - t1)
+    return sorted(pairs)
@@ -0,0 +1,28 @@
+#!/usr/bin/python
+
+import sys
+sys.path.insert(0, "/usr/local/lib/python2.7/site-packages/")
+
+import argparse
+
+sys.path.append('../lib')
+import ProjectMgr
+
+# one time import of the original per image .info files into the
+# project meta data database (images.db).  Projects are also imported
+# automatically (image by image) the first time they are loaded, this
+# script just does it all up front, or with --force re-imports the
+# .info files over the top of the existing database records.
+
+parser = argparse.ArgumentParser(description='Import the per image .info files.')
+parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--force', action='store_true',
+                    help='replace existing database records with the .info file contents')
+
+args = parser.parse_args()
+
+proj = ProjectMgr.ProjectMgr(args.project)
+proj.load_image_info()
+
+count = proj.import_image_meta(force=args.force)
+print "Imported meta data for %d images" % count
@@ -29,6 +29,8 @@ parser = argparse.ArgumentParser(description='Set the initial camera poses.')
 parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--pose', required=True, default='direct',
                     choices=(['direct', 'sba']), help='select pose')
+parser.add_argument('--render-scale', type=float, default=1.0,
+                    help='render from a reduced resolution decode of the source images (i.e. 0.5, 0.25)')
 
 args = parser.parse_args()
 
@@ -85,7 +87,8 @@ for image in proj.image_list:
     scale = float(image.width) / float(camw)
     K = proj.cam.get_K(scale)
     x, y, warped = proj.render.drawImage(image, K, dist_coeffs,
-                                         proj.source_dir, cm_per_pixel=20)
+                                         proj.source_dir, cm_per_pixel=20,
+                                         scale=args.render_scale)
     #print image.coverage_ned()
     (minlon, minlat, maxlon, maxlat) = image.coverage_lla(ref)
     cv2.imshow('warped', warped)
@@ -28,6 +28,8 @@ parser = argparse.ArgumentParser(description='Load the project\'s images.')
 parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--detector', default='SIFT',
                     choices=['SIFT', 'SURF', 'ORB', 'Star'])
+parser.add_argument('--detect-scale', type=float, default=1.0,
+                    help='detect features on a scaled down image, 0.5, 0.25, and 0.125 decode directly at the reduced resolution (keypoints are always saved in full image coordinates)')
 parser.add_argument('--sift-max-features', default=2000,
                     help='maximum SIFT features')
 parser.add_argument('--surf-hessian-threshold', default=600,
@@ -46,9 +48,15 @@ parser.add_argument('--star-line-threshold-binarized', default=8)
 parser.add_argument('--star-suppress-nonmax-size', default=5)
 
 parser.add_argument('--force', action='store_true',
-                    help='force redection of features even if features already exist')
+                    help='force redection of features even if they are current (features are otherwise only redetected for images or detector parameters that changed)')
 parser.add_argument('--show', action='store_true',
                     help='show features as we detect them')
+parser.add_argument('--jobs', type=int, default=1,
+                    help='number of worker processes to detect features with')
+parser.add_argument('--readers', type=int, default=2,
+                    help='number of threads decoding images ahead of detection (--jobs 1, with more jobs every worker decodes its own images)')
+parser.add_argument('--queue-depth', type=int, default=4,
+                    help='maximum number of decoded images held ahead of detection (--jobs 1)')
 
 args = parser.parse_args()
 
@@ -56,6 +64,7 @@ proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_image_info()
 
 detector_params = { 'detector': args.detector,
+                    'detect-scale': args.detect_scale,
                     'sift-max-features': args.sift_max_features,
                     'surf-hessian-threshold': args.surf_hessian_threshold,
                     'surf-noctaves': args.surf_noctaves,
@@ -69,7 +78,11 @@ detector_params = { 'detector': args.detector,
 proj.set_detector_params(detector_params)
 proj.save()
 
-proj.detect_features(force=args.force, show=args.show)
+proj.detect_features(force=args.force, show=args.show, jobs=args.jobs,
+                     readers=args.readers, queue_depth=args.queue_depth)
+
+# pick up the features of images that were already current
+proj.load_features(descriptors=False)
 
 feature_count = 0
 image_count = 0
@@ -52,11 +52,16 @@ proj.fastProjectKeypointsTo3d(sss)
 # at this point image.coord_list will contain nans for any troublesome
 # fringe features, lets dump them
 for image in proj.image_list:
-    for i in reversed(range(len(image.coord_list))):
-        if np.isnan( image.coord_list[i][0]):
-            image.kp_list.pop(i)
-            np.des_list = np.delete(image.des_list, i, 0)
-            image.coord_list.pop(i)
+    coords = np.array(image.coord_list).reshape(-1, 3)
+    if len(coords) != len(image.kp_list):
+        # not projected (i.e. no camera pose), nothing to cull by
+        print "Skipping", image.name, "(keypoints not projected)"
+        continue
+    keep = np.logical_not(np.isnan(coords[:,0]))
+    image.kp_list = image.kp_list[keep]
+    if len(image.des_list):
+        image.des_list = image.des_list[keep]
+    image.coord_list = list(coords[keep])
     image.save_features()
     image.save_descriptors()
     # and wipe any existing matches since the index may have all changed
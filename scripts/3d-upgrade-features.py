@@ -0,0 +1,39 @@
+#!/usr/bin/python
+
+import sys
+sys.path.insert(0, "/usr/local/lib/python2.7/site-packages/")
+
+import argparse
+
+sys.path.append('../lib')
+import ProjectMgr
+
+# convert all the original format (pickled tuple list or json) feature
+# files in the project to the binary keypoint format.  Projects still
+# open without this step, but loading the original format is much
+# slower.  Optionally pack the per image feature files into the single
+# project feature archive.
+
+parser = argparse.ArgumentParser(description='Upgrade the project feature files.')
+parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--remove-legacy', action='store_true',
+                    help='delete the original feature files after a successful conversion')
+parser.add_argument('--archive', action='store_true',
+                    help='pack per image feature files into the project feature archive')
+parser.add_argument('--compact', action='store_true',
+                    help='reclaim space used by superseded archive entries')
+
+args = parser.parse_args()
+
+proj = ProjectMgr.ProjectMgr(args.project)
+proj.load_image_info()
+
+count, errors = proj.upgrade_features(remove_legacy=args.remove_legacy)
+print "Upgraded %d feature files (%d errors)" % (count, errors)
+
+if args.archive:
+    count = proj.archive_features()
+    print "Archived features for %d images" % count
+
+if args.compact:
+    proj.archive.compact()
@@ -15,32 +15,73 @@ from progress.bar import Bar
 import scipy.spatial
 
 sys.path.append('../lib')
+import CandidatePairs
+import GeometricVerify
+import MatchJournal
+import MatchMetrics
 import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import VocabTree
 
 # working on matching features ...
 
 parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
 parser.add_argument('--matcher', default='FLANN',
-                    choices=['FLANN', 'BF'])
+                    choices=['FLANN', 'BF', 'Hamming', 'Cascade'])
+parser.add_argument('--cascade-bits', default=128, type=int,
+                    help='cascade hash code length (bits)')
+parser.add_argument('--cascade-candidates', default=10, type=int,
+                    help='cascade hash candidates compared exactly per feature (more is slower and more accurate)')
 parser.add_argument('--match-ratio', default=0.75, type=float,
                     help='match ratio')
 parser.add_argument('--min-pairs', default=30, type=int,
                     help='minimum matches between image pairs to keep')
 parser.add_argument('--filter', default='homography',
                     choices=['homography', 'fundamental', 'none'])
+parser.add_argument('--verify-method', default='ransac',
+                    choices=sorted(GeometricVerify.methods.keys()),
+                    help='robust estimator for the pair geometry')
+parser.add_argument('--verify-confidence', default=0.999, type=float,
+                    help='stop sampling once the model is this likely to be right')
 parser.add_argument('--image-fuzz', default=40, type=float, help='image fuzz') 
 parser.add_argument('--feature-fuzz', default=20, type=float, help='feature fuzz') 
 parser.add_argument('--ground', type=float, help='ground elevation in meters')
+parser.add_argument('--cache-mb', default=4096, type=int,
+                    help='memory budget (Mb) for resident image descriptors')
+parser.add_argument('--all-pairs', action='store_true',
+                    help='match every image pair, not just the pairs whose bounding spheres overlap')
+parser.add_argument('--sequential', type=int, metavar='WINDOW',
+                    help='time ordered images (i.e. movie frames): match each image with the next WINDOW images only')
+parser.add_argument('--loop-closure', action='store_true',
+                    help='with --sequential, also match images further apart in time whose bounding spheres overlap')
+parser.add_argument('--retrieval', type=int, metavar='K',
+                    help='also match each image with its K most visually similar images (vocabulary tree retrieval)')
+parser.add_argument('--retrieval-only', action='store_true',
+                    help='with --retrieval, use only the visually similar pairs (poses are unreliable)')
+parser.add_argument('--retrain-vocab', action='store_true',
+                    help='train a new vocabulary even if the project has one')
+parser.add_argument('--jobs', default=1, type=int,
+                    help='number of worker processes to match image pairs with')
+parser.add_argument('--save-kdtrees', action='store_true',
+                    help='save the per image kd-trees (and reuse saved ones when the keypoint coordinates are unchanged)')
+parser.add_argument('--resume', action='store_true',
+                    help='skip the pairs a previous (interrupted) run already matched with the same parameters')
+parser.add_argument('--restart-pairs', nargs='+', default=[],
+                    help='with --resume, match any pair involving these images (names or patterns) again')
+parser.add_argument('--debug-plots', action='store_true',
+                    help='write gnuplot files of the matches (c1.txt, c2.txt, vector.txt) for each pair')
+parser.add_argument('--feature-index', action='store_true',
+                    help='with the FLANN matcher, build (and save/reuse) one index per image for all its pairs.  Faster, but flann indices are randomized so results can vary with --jobs and between rebuilt and reused indices')
 
 args = parser.parse_args()
 
 proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_image_info()
-proj.load_features()
+proj.load_features(descriptors=False)
+proj.des_cache.set_budget(args.cache_mb * 1024 * 1024)
 proj.undistort_keypoints()
 
 if args.ground:
@@ -88,26 +129,27 @@ else:
 # compute a bounding sphere for each image
 bar = Bar('Compute bounding spheres:',
           max = len(proj.image_list))
-for image in proj.image_list:
-    sum = np.array([0.0, 0.0, 0.0])
-    if len(image.coord_list) == 0:
-        image.center = np.array([0.0, 0.0, 0.0])
-        image.radius = 1.0
-        continue
-    for p in image.coord_list:
-        if not np.isnan(p[0]):
-            sum += p
-    image.center = sum / len(image.coord_list)
-    max_dist = 0.0
-    for p in image.coord_list:
-        if not np.isnan(p[0]):
-            dist = np.linalg.norm(image.center - p)
-            if dist > max_dist:
-                max_dist = dist
-    image.radius = max_dist
-    image.save_meta()
-    # print "center = %s radius = %.1f" % (image.center, image.radius)
-    bar.next()
+with proj.metadb.batch():
+    for image in proj.image_list:
+        sum = np.array([0.0, 0.0, 0.0])
+        if len(image.coord_list) == 0:
+            image.center = np.array([0.0, 0.0, 0.0])
+            image.radius = 1.0
+            continue
+        for p in image.coord_list:
+            if not np.isnan(p[0]):
+                sum += p
+        image.center = sum / len(image.coord_list)
+        max_dist = 0.0
+        for p in image.coord_list:
+            if not np.isnan(p[0]):
+                dist = np.linalg.norm(image.center - p)
+                if dist > max_dist:
+                    max_dist = dist
+        image.radius = max_dist
+        image.save_meta()
+        # print "center = %s radius = %.1f" % (image.center, image.radius)
+        bar.next()
 bar.finish()
         
 
@@ -116,11 +158,7 @@ bar.finish()
 bar = Bar('Construct KDTrees:',
           max = len(proj.image_list))
 for image in proj.image_list:
-    if len(image.coord_list):
-        # print image.coord_list
-        image.kdtree = scipy.spatial.KDTree(image.coord_list)
-    else:
-        image.kdtree = None
+    image.spatial_index(cache=args.save_kdtrees)
 
     #result = image.kdtree.query_ball_point(image.coord_list[0], 5.0)
     #p1 = image.coord_list[0]
@@ -139,16 +177,77 @@ proj.matcher_params = { 'matcher': args.matcher,
                         'match-ratio': args.match_ratio,
                         'filter': args.filter,
                         'image-fuzz': args.image_fuzz,
-                        'feature-fuzz': args.feature_fuzz }
+                        'feature-fuzz': args.feature_fuzz,
+                        'feature-index': args.feature_index,
+                        'verify-method': args.verify_method,
+                        'verify-confidence': args.verify_confidence,
+                        'cascade-bits': args.cascade_bits,
+                        'cascade-candidates': args.cascade_candidates }
 proj.save()
 
 # fire up the matcher
 m = Matcher.Matcher()
 m.min_pairs = args.min_pairs
+m.debug_plots = args.debug_plots
 m.configure(proj.detector_params, proj.matcher_params)
-m.robustGroupMatches(proj.image_list, filter=args.filter,
+if m.feature_index:
+    # resident indices come out of the same --cache-mb budget as the
+    # descriptors
+    budget = args.cache_mb * 1024 * 1024
+    proj.des_cache.set_budget(budget / 2)
+    m.feature_index.set_budget(budget / 2)
+
+# camera calibration (scaled to the project image size)
+camw, camh = proj.cam.get_image_params()
+scale = float(proj.image_list[0].width) / float(camw)
+K = proj.cam.get_K(scale)
+
+# completed pairs are journaled as they finish so an interrupted run
+# can be resumed
+journal_params = { 'detector': proj.detector_params,
+                   'matcher': proj.matcher_params,
+                   'ground': args.ground,
+                   'retrieval': [ args.retrieval, args.retrieval_only ],
+                   'K': K.tolist() }
+journal = MatchJournal.MatchJournal(proj.project_dir, journal_params,
+                                    resume=args.resume,
+                                    restart_pairs=args.restart_pairs)
+# counts and timings of every matched pair
+metrics_log = MatchMetrics.MatchMetrics(proj.project_dir, append=args.resume)
+
+if args.all_pairs:
+    pairs = CandidatePairs.all_pairs(proj.image_list)
+elif args.sequential:
+    pairs = CandidatePairs.sequential_pairs(proj.image_list, args.sequential,
+                                            args.loop_closure,
+                                            args.image_fuzz)
+else:
+    pairs = CandidatePairs.spatial_pairs(proj.image_list, args.image_fuzz)
+if args.retrieval:
+    vocab_file = proj.project_dir + "/vocab.npz"
+    vocab = None
+    if not args.retrain_vocab:
+        vocab = VocabTree.load(vocab_file)
+    if vocab == None:
+        vocab = VocabTree.train_from_images(proj.image_list, proj.des_cache)
+        vocab.save(vocab_file)
+    visual = VocabTree.similar_pairs(proj.image_list, vocab, args.retrieval,
+                                     proj.des_cache)
+    if args.retrieval_only:
+        m.visual_pairs = set(visual)
+        pairs = visual
+    else:
+        # visual pairs the geometry didn't already suggest
+        m.visual_pairs = set(visual) - set(pairs)
+        pairs = sorted(set(pairs) | set(visual))
+    print "Visual pairs matched without the projected overlap:", \
+        len(m.visual_pairs)
+m.robustGroupMatches(proj.image_list, K, filter=args.filter,
                      image_fuzz=args.image_fuzz, feature_fuzz=args.feature_fuzz,
-                     review=False)
+                     review=False, des_cache=proj.des_cache, pairs=pairs,
+                     jobs=args.jobs, journal=journal, metrics_log=metrics_log)
+journal.close()
+metrics_log.close()
 
 # compute cycle dist starting from the most connected image (relative
 # errors may tend to build up as cycle distance increases.) (not now
@@ -19,6 +19,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import TrackTable
 
 # Reset all match point locations to their original direct
 # georeferenced locations based on estimated camera pose and
@@ -238,7 +239,7 @@ for match in matches_direct:
     match[0] = ned.tolist()
 
 print "Writing match file ..."
-pickle.dump(matches_direct, open(args.project + "/matches_direct", "wb"))
+TrackTable.save_matches(matches_direct, args.project + "/matches_direct")
 
 #print "temp: writing ascii version..."
 #for match in matches_direct:
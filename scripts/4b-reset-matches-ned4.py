@@ -19,6 +19,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import TrackTable
 
 # Rest all match point locations to their original direct
 # georeferenced locations based on estimated camera pose and
@@ -74,7 +75,7 @@ print "total features in image set = %d" % len(matches_direct)
 print "2 images per feature, no redundancy removal."
 
 print "Writing match file ..."
-pickle.dump(matches_direct, open(args.project + "/matches_direct", "wb"))
+TrackTable.save_matches(matches_direct, args.project + "/matches_direct")
 
 print "temp: writing matches_direct ascii version..."
 f = open(args.project + "/matches_direct.ascii", "wb")
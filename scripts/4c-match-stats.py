@@ -18,6 +18,7 @@ sys.path.append('../lib')
 import Matcher
 import Pose
 import ProjectMgr
+import TrackTable
 
 # working on matching features ...
 
@@ -32,7 +33,7 @@ proj.load_features()
 proj.load_match_pairs()
 
 print "Loading original (direct) matches ..."
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 print "Total unique features =", len(matches_direct)
 
 print "Generating match pairs"
@@ -78,5 +79,5 @@ if mark_sum > 0:
                 matches_direct.pop(i)
         # write out the updated match dictionaries
         print "Writing direct matches..."
-        pickle.dump(matches_direct, open(args.project+"/matches_direct", "wb"))
+        TrackTable.save_matches(matches_direct, args.project + "/matches_direct")
 
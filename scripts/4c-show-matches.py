@@ -18,6 +18,7 @@ sys.path.append('../lib')
 import Matcher
 import Pose
 import ProjectMgr
+import TrackTable
 
 # working on matching features ...
 
@@ -69,9 +70,9 @@ elif args.index:
         print "Cannot locate:", args.index
 elif args.direct or args.sba:
     if args.direct:
-        matches_list = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+        matches_list = TrackTable.load_matches(args.project + "/matches_direct")
     else:
-        matches_list = pickle.load( open( args.project + "/matches_sba", "rb" ) )
+        matches_list = TrackTable.load_matches(args.project + "/matches_sba")
     for i, i1 in enumerate(proj.image_list):
         for j, i2 in enumerate(proj.image_list):
             if j <= i:
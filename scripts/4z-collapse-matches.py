@@ -19,6 +19,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import TrackTable
 
 # Reset all match point locations to their original direct
 # georeferenced locations based on estimated camera pose and
@@ -36,10 +37,10 @@ proj.undistort_keypoints()
 proj.load_match_pairs()
 
 print "Loading original (direct) matches ..."
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 
 print "Loading fitted (sba) matches..."
-matches_sba = pickle.load( open( args.project + "/matches_sba", "rb" ) )
+matches_sba = TrackTable.load_matches(args.project + "/matches_sba")
 
 # collect/group match chains that refer to the same keypoint (warning,
 # if there are bad matches this can over-constrain the problem or tie
@@ -112,10 +113,10 @@ if count > 0.1:
 
 
 print "Writing direct match file ..."
-pickle.dump(matches_direct, open(args.project + "/matches_direct", "wb"))
+TrackTable.save_matches(matches_direct, args.project + "/matches_direct")
 
 print "Writing sba match file ..."
-pickle.dump(matches_sba, open(args.project + "/matches_sba", "wb"))
+TrackTable.save_matches(matches_sba, args.project + "/matches_sba")
 
 for match in matches_direct:
     print match
@@ -19,6 +19,7 @@ sys.path.append('../lib')
 import Matcher
 import ProjectMgr
 import SBA
+import TrackTable
 import transformations
 
 d2r = math.pi / 180.0       # a helpful constant
@@ -72,7 +73,7 @@ proj.undistort_keypoints()
 
 #m = Matcher.Matcher()
 
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 print "unique features:", len(matches_direct)
 
 image_width = proj.image_list[0].width
@@ -175,7 +176,7 @@ for i, match in enumerate(matches_sba):
 
 # write out the updated match_dict
 print "Writing match_sba file ...", len(matches_sba), 'features'
-pickle.dump(matches_sba, open(args.project + "/matches_sba", "wb"))
+TrackTable.save_matches(matches_sba, args.project + "/matches_sba")
 
 # collect/group match chains that refer to the same keypoint
 
@@ -230,4 +231,4 @@ matches_group = matches_tmp
 
 # write out the updated match_dict
 print "Writing match_group file ...", len(matches_group), 'features'
-pickle.dump(matches_group, open(args.project + "/matches_group", "wb"))
+TrackTable.save_matches(matches_group, args.project + "/matches_group")
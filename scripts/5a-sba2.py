@@ -21,6 +21,7 @@ sys.path.append('../lib')
 import Matcher
 import ProjectMgr
 import SBA
+import TrackTable
 import transformations
 
 d2r = math.pi / 180.0       # a helpful constant
@@ -127,7 +128,7 @@ proj.undistort_keypoints()
 
 #m = Matcher.Matcher()
 
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 print "unique features:", len(matches_direct)
 
 # collect/group match chains that refer to the same keypoint
@@ -330,4 +331,4 @@ for i, match in enumerate(matches_sba):
 
 # write out the updated match_dict
 print "Writing match_sba file ...", len(matches_sba), 'features'
-pickle.dump(matches_sba, open(args.project + "/matches_sba", "wb"))
+TrackTable.save_matches(matches_sba, args.project + "/matches_sba")
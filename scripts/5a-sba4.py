@@ -21,6 +21,7 @@ sys.path.append('../lib')
 import Matcher
 import ProjectMgr
 import SBA
+import TrackTable
 import transformations
 
 # constants
@@ -277,7 +278,7 @@ proj.load_features()
 proj.undistort_keypoints()
 proj.load_match_pairs()
 
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 print "unique features (before grouping):", len(matches_direct)
 
 # determine scale value so we can get correct K matrix
@@ -600,7 +601,7 @@ while True:
     
     # write out the updated matches_group file as matches_sba
     print "Writing match_sba file ...", len(matches_group), 'features'
-    pickle.dump(matches_group, open(args.project + "/matches_sba", "wb"))
+    TrackTable.save_matches(matches_group, args.project + "/matches_sba")
 
     errorFunc()
 
@@ -715,5 +716,5 @@ for i, match in enumerate(matches_sba):
 
 # write out the updated match_dict
 print "Writing match_sba file ...", len(matches_sba), 'features'
-pickle.dump(matches_sba, open(args.project + "/matches_sba", "wb"))
+TrackTable.save_matches(matches_sba, args.project + "/matches_sba")
 
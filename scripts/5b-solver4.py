@@ -28,6 +28,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import TrackTable
 import transformations
 
 # constants
@@ -48,7 +49,7 @@ proj.load_image_info()
 proj.load_features()
 proj.undistort_keypoints()
 
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 print "unique features:", len(matches_direct)
 
 # compute keypoint usage map
@@ -560,7 +561,7 @@ print 'Start mre:', start_mre, 'end mre:', mre
 result=raw_input('Update matches and camera poses? (y/n):')
 if result == 'y' or result == 'Y':
     print 'Writing direct matches...'
-    pickle.dump(matches_direct, open(args.project+"/matches_direct", "wb"))
+    TrackTable.save_matches(matches_direct, args.project + "/matches_direct")
 
     print 'Updating and saving camera poses...'
     for image in proj.image_list:
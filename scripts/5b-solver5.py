@@ -28,6 +28,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import TrackTable
 import transformations
 
 # constants
@@ -48,7 +49,7 @@ proj.load_image_info()
 proj.load_features()
 proj.undistort_keypoints()
 
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 print "unique features:", len(matches_direct)
 
 # compute keypoint usage map
@@ -68,21 +69,28 @@ import LineSolver
 def my_triangulate(matches_direct, cam_dict):
     IK = np.linalg.inv( proj.cam.get_K() )
 
+    # project all the keypoints of an image in one batch the first
+    # time a match refers to it
+    image_vectors = {}
+    def get_vectors(index):
+        if not index in image_vectors:
+            image = proj.image_list[index]
+            cam2body = image.get_cam2body()
+            body2ned = image.rvec_to_body2ned(cam_dict[image.name]['rvec'])
+            image_vectors[index] = proj.projectVectorsArray(IK, body2ned,
+                                                            cam2body,
+                                                            image.uv_list)
+        return image_vectors[index]
+
     for match in matches_direct:
         #print match
         points = []
         vectors = []
         for m in match[1:]:
             image = proj.image_list[m[0]]
-            cam2body = image.get_cam2body()
-            body2ned = image.rvec_to_body2ned(cam_dict[image.name]['rvec'])
-            uv_list = [ image.uv_list[m[1]] ] # just one uv element
-            vec_list = proj.projectVectors(IK, body2ned, cam2body, uv_list)
             points.append( cam_dict[image.name]['ned'] )
-            vectors.append( vec_list[0] )
+            vectors.append( get_vectors(m[0])[m[1]] )
             #print ' ', image.name
-            #print ' ', uv_list
-            #print '  ', vec_list
         p = LineSolver.ls_lines_intersection(points, vectors, transpose=True).tolist()
         #print p, p[0]
         match[0] = [ p[0][0], p[1][0], p[2][0] ]
@@ -599,7 +607,7 @@ print 'Start mre:', start_mre, 'end mre:', mre
 result=raw_input('Update matches and camera poses? (y/n):')
 if result == 'y' or result == 'Y':
     print 'Writing direct matches...'
-    pickle.dump(matches_direct, open(args.project+"/matches_direct", "wb"))
+    TrackTable.save_matches(matches_direct, args.project + "/matches_direct")
 
     print 'Updating and saving camera poses...'
     for image in proj.image_list:
@@ -15,6 +15,7 @@ import numpy as np
 
 sys.path.append('../lib')
 import ProjectMgr
+import TrackTable
 
 parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
@@ -32,11 +33,11 @@ proj.load_features()
 proj.undistort_keypoints()
 
 print "Loading original (direct) matches ..."
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 
 if not args.direct:
     print "Loading fitted (sba) matches..."
-    matches_sba = pickle.load( open( args.project + "/matches_sba", "rb" ) )
+    matches_sba = TrackTable.load_matches(args.project + "/matches_sba")
 
 # image mean reprojection error
 def compute_feature_mre(K, image, kp, ned):
@@ -145,11 +146,11 @@ if deleted_sum > 0:
     if result == 'y' or result == 'Y':
         # write out the updated match dictionaries
         print "Writing direct matches..."
-        pickle.dump(matches_direct, open(args.project+"/matches_direct", "wb"))
+        TrackTable.save_matches(matches_direct, args.project + "/matches_direct")
 
         if not args.direct:
             print "Writing sba matches..."
-            pickle.dump(matches_sba, open(args.project + "/matches_sba", "wb"))
+            TrackTable.save_matches(matches_sba, args.project + "/matches_sba")
 
 
 #print "Mean reprojection error = %.4f" % (mre)
@@ -15,6 +15,7 @@ import numpy as np
 
 sys.path.append('../lib')
 import ProjectMgr
+import TrackTable
 
 parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
@@ -35,13 +36,13 @@ proj.load_features()
 proj.undistort_keypoints()
 
 print "Loading original (direct) matches ..."
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 
 print "Loading maximally grouped matches ..."
-matches_group = pickle.load( open( args.project + "/matches_group", "rb" ) )
+matches_group = TrackTable.load_matches(args.project + "/matches_group")
 
 print "Loading fitted (sba) matches..."
-matches_sba = pickle.load( open( args.project + "/matches_sba", "rb" ) )
+matches_sba = TrackTable.load_matches(args.project + "/matches_sba")
 
 # image mean reprojection error
 def compute_feature_mre(K, image, kp, ned):
@@ -307,11 +308,11 @@ if mark_sum > 0:
         delete_marked_matches()
         # write out the updated match dictionaries
         print "Writing direct matches..."
-        pickle.dump(matches_direct, open(args.project+"/matches_direct", "wb"))
+        TrackTable.save_matches(matches_direct, args.project + "/matches_direct")
 
         if not args.direct:
             print "Writing sba matches..."
-            pickle.dump(matches_sba, open(args.project + "/matches_sba", "wb"))
+            TrackTable.save_matches(matches_sba, args.project + "/matches_sba")
 
 #print "Mean reprojection error = %.4f" % (mre)
 
@@ -22,6 +22,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import TrackTable
 import transformations
 
 
@@ -52,10 +53,10 @@ proj = ProjectMgr.ProjectMgr(args.project)
 proj.load_image_info()
         
 print "Loading original (direct) matches ..."
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 
 print "Loading fitted (sba) matches..."
-matches_sba = pickle.load( open( args.project + "/matches_sba", "rb" ) )
+matches_sba = TrackTable.load_matches(args.project + "/matches_sba")
 
 # custom slope routine
 def my_slope(p1, p2, z1, z2):
@@ -159,7 +160,7 @@ if deleted_sum > 0:
 
         # write out the updated match dictionaries
         print "Writing original matches..."
-        pickle.dump(matches_direct, open(args.project+"/matches_direct", "wb"))
+        TrackTable.save_matches(matches_direct, args.project + "/matches_direct")
 
         print "Writing sba matches..."
-        pickle.dump(matches_sba, open(args.project+"/matches_sba", "wb"))
+        TrackTable.save_matches(matches_sba, args.project + "/matches_sba")
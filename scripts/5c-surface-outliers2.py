@@ -27,6 +27,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import TrackTable
 import transformations
 
 
@@ -60,10 +61,10 @@ proj.load_image_info()
 proj.load_features()
 
 print "Loading original (direct) matches ..."
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 
 print "Loading fitted (sba) matches..."
-matches_sba = pickle.load( open( args.project + "/matches_sba", "rb" ) )
+matches_sba = TrackTable.load_matches(args.project + "/matches_sba")
 
 def compute_surface_outliers():
     # start with a clean slate
@@ -177,10 +178,10 @@ def compute_surface_outliers():
 def save_results():
     # write out the updated match dictionaries
     print "Writing original matches..."
-    pickle.dump(matches_direct, open(args.project+"/matches_direct", "wb"))
+    TrackTable.save_matches(matches_direct, args.project + "/matches_direct")
 
     print "Writing sba matches..."
-    pickle.dump(matches_sba, open(args.project+"/matches_sba", "wb"))
+    TrackTable.save_matches(matches_sba, args.project + "/matches_sba")
 
 deleted_sum = 0
 result = compute_surface_outliers()
@@ -46,7 +46,9 @@ sys.path.append('../lib')
 import Matcher
 import Pose
 import ProjectMgr
+import SpatialIndex
 import SRTM
+import TrackTable
 import transformations
 
 def meta_stats(report):
@@ -80,10 +82,10 @@ proj.load_features()
 proj.undistort_keypoints()
 
 print "Loading original (direct) matches ..."
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
 
 print "Loading fitted (sba) matches..."
-matches_sba = pickle.load( open( args.project + "/matches_sba", "rb" ) )
+matches_sba = TrackTable.load_matches(args.project + "/matches_sba")
 print "features:", len(matches_sba)
 
 def compute_surface_outliers():
@@ -117,7 +119,7 @@ def compute_surface_outliers():
     print 'Constructing kd trees...'
     for image in proj.image_list:
         if len(image.feat_uv):
-            image.kdtree = scipy.spatial.KDTree(image.feat_uv)
+            image.kdtree = SpatialIndex.SpatialIndex(image.feat_uv)
             
     print "Processing images..."
     report = []
@@ -126,9 +128,13 @@ def compute_surface_outliers():
         if len(image.feat_uv) and len(image.feat_uv) < 3:
             print "Image with > 0, but < 3 features"
             continue
+        if len(image.feat_uv):
+            # all the neighbor lookups for the image in one query
+            (dist_all, index_all) = image.kdtree.query(image.feat_uv, k=30)
         for i, uv in enumerate(image.feat_uv):
             #print 'uv:', uv, image.feat_3d[i]
-            (dist_uv, index) = image.kdtree.query(uv, k=30)
+            dist_uv = dist_all[i]
+            index = index_all[i]
             #print dist_uv, index
             # compare the 2d distance vs 3d distance for nearby neighbors
             dist_2d = []
@@ -266,10 +272,10 @@ def draw_match(i, index):
 def save_results():
     # write out the updated match dictionaries
     print "Writing original matches..."
-    pickle.dump(matches_direct, open(args.project+"/matches_direct", "wb"))
+    TrackTable.save_matches(matches_direct, args.project + "/matches_direct")
 
     print "Writing sba matches..."
-    pickle.dump(matches_sba, open(args.project+"/matches_sba", "wb"))
+    TrackTable.save_matches(matches_sba, args.project + "/matches_sba")
 
 deleted_sum = 0
 result = compute_surface_outliers()
@@ -13,6 +13,7 @@ import os.path
 
 sys.path.append('../lib')
 import ProjectMgr
+import TrackTable
 
 parser = argparse.ArgumentParser(description='Keypoint projection.')
 parser.add_argument('--project', required=True, help='project directory')
@@ -21,8 +22,8 @@ args = parser.parse_args()
 proj = ProjectMgr.ProjectMgr(args.project)
 
 print "Loading matches ..."
-matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
-matches_sba = pickle.load( open( args.project + "/matches_sba", "rb" ) )
+matches_direct = TrackTable.load_matches(args.project + "/matches_direct")
+matches_sba = TrackTable.load_matches(args.project + "/matches_sba")
 
 fig = plt.figure()
 
@@ -20,6 +20,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import TrackTable
 import transformations
 
 
@@ -125,7 +126,7 @@ proj.load_features()
 proj.load_match_pairs()
 
 print "Loading match points..."
-matches_sba = pickle.load( open( args.project + "/matches_sba", "rb" ) )
+matches_sba = TrackTable.load_matches(args.project + "/matches_sba")
 
 # iterate through the sba match dictionary and build a list of feature
 # points
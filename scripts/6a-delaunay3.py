@@ -22,6 +22,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import TrackTable
 import transformations
 
 parser = argparse.ArgumentParser(description='Compute Delauney triangulation of matches.')
@@ -131,7 +132,7 @@ proj.load_features()
 #proj.load_match_pairs()
         
 print "Loading match points (sba)..."
-matches_sba = pickle.load( open( args.project + "/matches_sba", "rb" ) )
+matches_sba = TrackTable.load_matches(args.project + "/matches_sba")
 #matches_direct = pickle.load( open( args.project + "/matches_direct", "rb" ) )
 
 # iterate through the sba match dictionary and build a list of feature
@@ -26,6 +26,7 @@ import Matcher
 import Pose
 import ProjectMgr
 import SRTM
+import TrackTable
 import transformations
 
 parser = argparse.ArgumentParser(description='Compute Delauney triangulation of matches.')
@@ -125,7 +126,7 @@ proj.load_features()
 proj.load_match_pairs()
         
 print "Loading match points (sba)..."
-matches_sba = pickle.load( open( args.project + "/matches_sba", "rb" ) )
+matches_sba = TrackTable.load_matches(args.project + "/matches_sba")
 #f = open(args.project + "/Matches-sba.json", 'r')
 #matches_sba = json.load(f)
 #f.close()
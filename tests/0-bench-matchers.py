@@ -0,0 +1,115 @@
+#!/usr/bin/python
+
+# Benchmark the k=2 descriptor matchers on a project's own descriptor
+# files: opencv brute force, opencv flann (LSH for binary descriptors,
+# kd-trees for float), the numpy HammingMatcher (binary only) and
+# CascadeHash (float only, at a few candidate counts.)  Reports the
+# time per pair (throughput) and how often each matcher agrees with
+# the exact brute force nearest neighbor and ratio test (recall.)
+
+import sys
+sys.path.insert(0, "/usr/local/lib/python2.7/site-packages/")
+
+import argparse
+import cv2
+import numpy as np
+import random
+import time
+
+sys.path.append('../lib')
+import CascadeHash
+import HammingMatcher
+import Matcher
+import ProjectMgr
+
+parser = argparse.ArgumentParser(description='Benchmark descriptor matchers.')
+parser.add_argument('--project', required=True, help='project directory')
+parser.add_argument('--pairs', default=20, type=int,
+                    help='number of (random) image pairs to match')
+parser.add_argument('--match-ratio', default=0.75, type=float,
+                    help='match ratio')
+args = parser.parse_args()
+
+proj = ProjectMgr.ProjectMgr(args.project)
+proj.load_image_info()
+proj.load_features(descriptors=False)
+
+detector = proj.detector_params.get('detector', 'SIFT')
+binary = detector in ['ORB', 'Star']
+if binary:
+    norm = cv2.NORM_HAMMING
+    flann_params = { 'algorithm': 6, # FLANN_INDEX_LSH
+                     'table_number': 6, 'key_size': 12,
+                     'multi_probe_level': 1 }
+else:
+    norm = cv2.NORM_L2
+    flann_params = { 'algorithm': 1, 'trees': 5 } # FLANN_INDEX_KDTREE
+
+def opencv_knn(matcher, des1, des2):
+    matches = matcher.knnMatch(des1, trainDescriptors=des2, k=2)
+    query, train, dist = Matcher.knn_arrays(matches)
+    index = np.full( (len(des1), 2), -1, dtype=int )
+    d = np.full( (len(des1), 2), np.inf )
+    index[query] = train
+    d[query] = dist
+    return index, d
+
+hamming = HammingMatcher.HammingMatcher()
+engines = [ ('BF', lambda a, b: opencv_knn(cv2.BFMatcher(norm), a, b)),
+            ('FLANN', lambda a, b: opencv_knn(cv2.FlannBasedMatcher(flann_params, {}), a, b)) ]
+if binary:
+    engines.append( ('Hamming', lambda a, b: hamming.knn(a, b, 2)) )
+else:
+    for c in [5, 10, 20]:
+        cascade = CascadeHash.CascadeHash(candidates=c)
+        engines.append( ('Cascade%d' % c,
+                         lambda a, b, cascade=cascade: cascade.knn(a, b, 2)) )
+
+n = len(proj.image_list)
+pairs = [ (i, j) for i in range(n) for j in range(i+1, n) ]
+random.seed(0)
+pairs = random.sample(pairs, min(args.pairs, len(pairs)))
+
+times = {}
+agree = {}
+kept = {}
+for name, engine in engines:
+    times[name] = 0.0
+    agree[name] = 0
+    kept[name] = 0
+total = 0
+for (i, j) in pairs:
+    i1 = proj.image_list[i]
+    i2 = proj.image_list[j]
+    proj.des_cache.get(i1)
+    proj.des_cache.get(i2)
+    des1 = np.asarray(i1.des_list)
+    des2 = np.asarray(i2.des_list)
+    if len(des1) < 2 or len(des2) < 2:
+        continue
+    print "%s (%d) vs %s (%d)" % (i1.name, len(des1), i2.name, len(des2))
+    results = {}
+    for name, engine in engines:
+        t0 = time.time()
+        index, dist = engine(des1, des2)
+        times[name] += time.time() - t0
+        passed = dist[:,0] <= dist[:,1] * args.match_ratio
+        results[name] = (index[:,0], passed)
+        kept[name] += np.count_nonzero(passed)
+    ref_index, ref_passed = results['BF']
+    for name, engine in engines:
+        index, passed = results[name]
+        agree[name] += np.count_nonzero(passed & ref_passed
+                                         & (index == ref_index))
+    total += np.count_nonzero(ref_passed)
+
+count = max(1, len(pairs))
+print
+print "%d pairs, %s descriptors" % (len(pairs), detector)
+for name, engine in engines:
+    if total:
+        recall = 100.0 * agree[name] / total
+    else:
+        recall = 0.0
+    print "%-9s %7.3f sec/pair  %8d ratio test matches  %5.1f%% of brute force" \
+        % (name, times[name] / count, kept[name], recall)
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+
+# Check that the feature archive survives an interrupted run: append
+# after a partially written (torn) index line and make sure both the
+# old and the new records load back.  Also check that reading many
+# arrays doesn't hold an open file per array.
+
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append('../lib')
+import FeatureArchive
+
+project_dir = tempfile.mkdtemp()
+try:
+    archive = FeatureArchive.FeatureArchive(project_dir)
+    des1 = np.arange(64, dtype=np.uint8).reshape(2, 32)
+    archive.append_descriptors('img1.jpg', des1)
+
+    # simulate a run killed part way through writing an index record
+    f = open(archive.index_file, 'a')
+    f.write('{"name": "img2.jpg", "kind": "desc", "fi')
+    f.close()
+
+    archive = FeatureArchive.FeatureArchive(project_dir)
+    des3 = np.arange(96, dtype=np.uint8).reshape(3, 32)
+    archive.append_descriptors('img3.jpg', des3)
+
+    archive = FeatureArchive.FeatureArchive(project_dir)
+    assert archive.has('img1.jpg', 'desc')
+    assert not archive.has('img2.jpg', 'desc')
+    assert archive.has('img3.jpg', 'desc'), "record after a torn line was lost"
+    assert np.array_equal(archive.load_descriptors('img1.jpg'), des1)
+    assert np.array_equal(archive.load_descriptors('img3.jpg'), des3)
+    print "ok: append after a torn index line"
+
+    if os.path.isdir('/proc/self/fd'):
+        before = len(os.listdir('/proc/self/fd'))
+        views = []
+        for i in range(500):
+            views.append(archive.load_descriptors('img%d.jpg' % (1 + 2 * (i % 2))))
+        after = len(os.listdir('/proc/self/fd'))
+        assert after - before <= 2, "%d open files for 500 views" % (after - before)
+        print "ok: one open file per blob"
+finally:
+    shutil.rmtree(project_dir)
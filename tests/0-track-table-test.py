@@ -0,0 +1,48 @@
+#!/usr/bin/python
+
+# Check that match lists round trip through a track table (both save
+# formats): unplaced features (ned None) come back as None, and a
+# placed feature whose location is NaN comes back as NaN, not None.
+
+import math
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append('../lib')
+import TrackTable
+
+matches = [ [ [1.0, 2.0, 3.0], [0, 5], [1, 7] ],
+            [ None, [0, 6], [2, 1] ],
+            [ [float('nan')] * 3, [1, 2], [2, 3], [3, 4] ] ]
+
+def check(result, label):
+    assert len(result) == len(matches)
+    assert result[0] == matches[0]
+    assert result[1] == matches[1], "%s: unplaced feature changed" % label
+    ned = result[2][0]
+    assert ned is not None, "%s: NaN location came back as None" % label
+    assert all([ math.isnan(v) for v in ned ])
+    assert result[2][1:] == matches[2][1:]
+    print "ok:", label
+
+project_dir = tempfile.mkdtemp()
+try:
+    basename = os.path.join(project_dir, "matches_direct")
+    TrackTable.save_matches(matches, basename)
+    check(TrackTable.load_matches(basename), "npz")
+
+    table = TrackTable.TrackTable.from_list(matches)
+    table.save(basename + "_dir")
+    check(TrackTable.TrackTable.load(basename + "_dir", mmap_mode='r').to_list(),
+          "npy directory")
+
+    # tables saved without 'placed' read all NaN locations as None
+    old = TrackTable.TrackTable(table.points, table.offsets, table.images,
+                                table.features)
+    assert old[1][0] is None and old[2][0] is None
+    print "ok: tables without placed flags"
+finally:
+    shutil.rmtree(project_dir)